@@ -1,4 +1,5 @@
 import csv
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 def _get_global_roles_and_descriptions_from_csv(file_path) -> dict:
@@ -19,23 +20,88 @@ class Settings(BaseSettings):
     
     # Logging settings
     log_file: str = "app.log"
-    log_max_size: int = 100000  # [bytes]
+    log_max_size: int = 10 * 1024 * 1024  # [bytes]
     log_backup_count: int = 3
+    log_queue_size: int = 10000 # Records waiting to be written (the next ones are dropped when full)
+    log_batch_size: int = 256 # Maximum number of records written at once
+    log_headers: list[str] = ["user-agent", "content-type", "content-length", "referer", "x-forwarded-for", "x-request-id", "authorization"] # "*" for all
+    log_redacted_headers: list[str] = ["authorization", "cookie", "set-cookie", "x-api-key"]
+    log_success_sample_rate: float = 1.0 # Fraction of the successful requests logged (errors are always logged)
+    log_slow_request_threshold: float = 1.0 # [seconds] Slower requests are always logged
+    
+    # Monitoring settings
+    metrics_enabled: bool = True # Time the requests and expose them on /metrics (Prometheus text format)
+    sql_profiler_enabled: bool = False # Count and time the SQL queries of each request (Server-Timing header and logs)
+    sql_profiler_n_plus_one_threshold: int = 5 # Warn when the same statement runs this many times in a request
     
     # Database settings
     database_url: str # See .env file for more details
     database_name: str = "eventapp"
+    database_async: bool = False # Use AsyncEngine/AsyncSession in the routers instead of the blocking Session
+    database_async_url: str | None = None # Defaults to database_url with its async driver (asyncpg, aiosqlite)
+    database_replica_urls: list[str] = [] # Read replicas of the global database (same format as database_url)
+    database_replica_max_lag: float = 5 # [seconds] Replicas further behind are skipped until they catch up
+    database_replica_check_interval: float = 2 # [seconds] Health and lag check of the replicas
+    database_read_your_writes_window: float = 10 # [seconds] Reads of a recently written user go to the primary
     minio_endpoint: str # See .env file for more details
     minio_access_key: str # See .env file for more details
     minio_secret_key: str # See .env file for more details
     minio_bucket_name: str # See .env file for more details
     minio_secure: bool = False
-    engine_cache_capacity: int = 10
+    storage_backend: str = "minio" # "minio" or "memory" (objects kept in the process, for the benchmarks)
+    minio_pool_size: int = 32 # Maximum number of connections kept open to MinIO
+    minio_connect_timeout: float = 5 # [seconds]
+    minio_read_timeout: float = 30 # [seconds]
+    minio_max_threads: int = 32 # Threads running the blocking MinIO calls of the async code
+    minio_part_size: int = 5 * 1024 * 1024 # [bytes] Part size of the multipart uploads (5 MiB minimum)
+    minio_presigned_url_expiration: int = 3600 # [seconds]
+    minio_presigned_url_margin: int = 300 # [seconds] Cached presigned URLs are renewed this long before they expire
+    minio_presigned_url_cache_capacity: int = 10000
+    event_tenancy: Literal["database", "schema"] = "database" # "database" (one database and engine per event) or "schema" (one schema per event in the global database, PostgreSQL only)
+    database_pool_size: int = 5 # Connections of the global engine (shared by all the events in the "schema" tenancy)
+    database_max_overflow: int = 10
+    engine_cache_capacity: int = 10 # Maximum number of event database engines kept open
+    event_db_max_connections: int = 50 # Connections budget shared by all the event databases
+    event_db_min_pool_size: int = 1
+    event_db_max_pool_size: int = 10
+    event_db_pool_timeout: float = 10 # [seconds]
+    event_db_idle_timeout: float = 300 # [seconds] Engines not used for this time are disposed
+    event_db_traffic_window: float = 60 # [seconds] Window of the traffic used to size the pools
+    event_db_template_name: str = "eventapp_event_template" # Migrated database cloned to create the event databases
+    event_db_spare_prefix: str = "eventapp_spare_"
+    event_db_spare_pool_size: int = 2 # Spare event databases cloned in advance (0 to clone on demand)
+    event_db_spare_refill_interval: float = 60 # [seconds] The pool is also refilled as soon as a spare database is used
+    
+    # Background jobs settings (jobs table of the global database, see app.db.jobs)
+    job_worker_threads: int = 2 # Threads running the jobs in each API process (0 to only run them in `python -m app.worker`)
+    job_poll_interval: float = 1 # [seconds] Workers also wake up at once when a job is enqueued in their process
+    job_lease: float = 300 # [seconds] A job claimed by a worker that stopped is run again after this delay
+    job_max_attempts: int = 5 # Then the job is kept with the "failed" status
+    job_backoff_base: float = 2 # [seconds] Delay before the first retry, doubled at each attempt
+    job_backoff_max: float = 600 # [seconds]
     
     # JWT settings
     jwt_secret_key: str # See .env file for more details
-    jwt_expiration: int = 3600 * 6 # 6 hours
+    jwt_expiration: int = 3600 * 6 # [seconds] 6 hours
     jwt_algorithm: str = "HS256" # HMAC-SHA256
+    token_cache_capacity: int = 10000 # Number of verified tokens kept in memory (0 to disable the cache)
+    token_revocation_bloom_capacity: int = 100000 # Revoked tokens in the Bloom filter before it is resized
+    token_revocation_bloom_error_rate: float = 0.001 # False positives (confirmed by a database query)
+    token_revocation_refresh_interval: float = 5 # [seconds] Revocations of the other worker processes are loaded this often
+    token_revocation_rebuild_interval: float = 600 # [seconds] The expired revocations are purged this often
+    token_revocation_commit_margin: float = 30 # [seconds] Revocations below the greatest id loaded are read again this long (late commits)
+
+    # Login and registration throttling settings (token buckets, checked before any password hashing)
+    throttle_enabled: bool = True
+    throttle_capacity: int = 100000 # Keys (IPs, IP and email pairs) kept per limiter, the least recently used are evicted
+    throttle_shards: int = 16 # Locks of each limiter
+    throttle_trust_forwarded_for: bool = False # Use X-Forwarded-For as client IP (only behind a trusted proxy)
+    login_ip_rate: float = 1 # [requests/second] Sustained login attempts per client IP
+    login_ip_burst: float = 20
+    login_email_rate: float = 0.2 # [requests/second] Sustained login attempts per email and client IP
+    login_email_burst: float = 10
+    register_ip_rate: float = 0.2 # [requests/second] Sustained registrations per client IP
+    register_ip_burst: float = 10
     
     # User global roles settings
     roles_csv_path: str = "../resources/roles.csv"
@@ -43,6 +109,21 @@ class Settings(BaseSettings):
     # User password settings
     user_password_regex :str = r"^[A-Za-z\d@$!%*?&]{8,64}$" # Between 8 and 64 characters with at least one letter, one number and one special character
     user_profile_picture_max_size: int = 5 * 1024 * 1024  # 5 MB
+    user_profile_picture_sizes: list[int] = [48, 128, 512] # [pixels] Sizes of the precomputed square variants
+    user_profile_picture_variant_quality: int = 80
+    user_profile_picture_download_mode: str = "proxy" # "proxy" (bytes sent by the API) or "redirect" (307 to a presigned URL)
+    image_workers: int = 2 # Number of processes rendering the image variants
+    user_import_batch_size: int = 500 # Rows deduplicated, hashed and inserted at once by the bulk import
+    user_import_max_errors: int = 1000 # Errors detailed in the import report (the next ones are only counted)
+    user_export_batch_size: int = 1000 # Rows fetched at once from the server-side cursor of the export
+    user_cache_capacity: int = 10000 # Users kept in the read cache of /users/me (0 to disable the cache)
+    user_cache_ttl: float = 30 # [seconds] Bounds the staleness of the cache of the other worker processes
+    
+    # Password hashing settings
+    password_hash_executor: str = "process" # "process", "thread" or "inline" (threadpool of the application)
+    password_hash_workers: int = 0 # 0 = number of CPU cores
+    password_hash_queue_size: int = 0 # Maximum number of pending hashes before answering 503 (0 = 2 x workers)
+    password_hash_rounds: int = 12 # bcrypt cost factor
     
     class Config:
         env_file = ".env"
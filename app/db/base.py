@@ -1,14 +1,38 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
+# Async drivers used when the async mode is enabled
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def get_async_database_url(database_name: str, database_url: str | None = None) -> str:
+    if database_url is None and settings.database_async_url:
+        return f"{settings.database_async_url}/{database_name}"
+    scheme, separator, rest = (database_url or settings.database_url).partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{separator}{rest}/{database_name}"
+
+def _pool_options(url: str) -> dict:
+    # SQLite engines may use a pool without a size (e.g. NullPool with aiosqlite)
+    if url.startswith("sqlite"):
+        return {}
+    return {"pool_size": settings.database_pool_size, "max_overflow": settings.database_max_overflow}
+
 # Global database connection
 SQLALCHEMY_DATABASE_URL = f"{settings.database_url}/{settings.database_name}"
-global_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+global_engine = create_engine(SQLALCHEMY_DATABASE_URL, **_pool_options(SQLALCHEMY_DATABASE_URL))
 GlobalSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=global_engine)
 
+# Global database connection (async mode)
+global_async_engine = create_async_engine(get_async_database_url(settings.database_name), **_pool_options(settings.database_url)) if settings.database_async else None
+GlobalAsyncSessionLocal = async_sessionmaker(bind=global_async_engine, autoflush=False, expire_on_commit=False) if settings.database_async else None
+
 # Base model for all database models
 GlobalBase = declarative_base() # Schema used for tables in global database
 EventBase = declarative_base()  # Schema used for tables in event database
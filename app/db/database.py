@@ -1,53 +1,66 @@
-import psycopg2
 import csv
-from sqlalchemy import create_engine
 
 from app.core.config import settings
-from app.db.base import global_engine, GlobalBase, EventBase, GlobalSessionLocal
-from app.dependencies import engine_cache, get_minio_db
+from app.db.base import global_engine, global_async_engine, GlobalBase, GlobalSessionLocal
+from app.db.jobs import job_handler
+from app.db.engines import event_engines, event_async_engines
+from app.db.provisioning import event_db_provisioner
+from app.db.replicas import replica_router
+from app.db.tenancy import create_event_schema, drop_event_schema
+from app.db.storage import storage
 from app.modules.role.schemas import RoleSchema
+from app.modules.user.schemas import create_user_indexes
+from app.modules.role.registry import role_registry
 
 # Postgres database
 def init_global_db():
     GlobalBase.metadata.create_all(bind=global_engine)
+    create_user_indexes(global_engine)
+    replica_router.start()
 
 def close_all_event_db():
-    for engine in engine_cache.values():
-        engine.dispose()
+    event_engines.dispose_all()
         
 def close_all_db():
     close_all_event_db()
+    replica_router.shutdown()
     global_engine.dispose()
+    
+async def close_all_async_db():
+    await event_async_engines.adispose_all()
+    await replica_router.adispose()
+    if global_async_engine is not None:
+        await global_async_engine.dispose()
+
+# Event databases (cloned from a template, see app.db.provisioning)
+def init_event_db_provisioning():
+    if settings.event_tenancy == "schema" and global_engine.dialect.name != "postgresql":
+        raise ValueError(f"The \"schema\" event tenancy requires PostgreSQL, not {global_engine.dialect.name}")
+    if global_engine.dialect.name == "postgresql" and settings.event_tenancy == "database":
+        event_db_provisioner.start()
+
+def close_event_db_provisioning():
+    event_db_provisioner.shutdown()
 
+@job_handler("event_db.create")
 def create_and_init_event_db(event_db_name: str):
-    global_db_url = f"{settings.database_url}/{settings.database_name}"
-    event_db_url = f"{settings.database_url}/{event_db_name}"
-    
-    # New database creation
-    conn = psycopg2.connect(global_db_url)
-    conn.autocommit = True
-    with conn.cursor() as cur:
-        cur.execute(f"CREATE DATABASE {event_db_name}")
-    conn.close()
-    
-    # New database initialization
-    event_engine = create_engine(event_db_url)
-    EventBase.metadata.create_all(bind=event_engine)
-    event_engine.dispose()
+    if settings.event_tenancy == "schema":
+        create_event_schema(event_db_name)
+        return
+    event_db_provisioner.create(event_db_name)
     
+@job_handler("event_db.delete")
 def delete_event_db(event_db_name: str):
-    global_db_url = f"{settings.database_url}/{settings.database_name}"
+    if settings.event_tenancy == "schema":
+        drop_event_schema(event_db_name)
+        return
     
     # Enshure the database is closed
-    if event_db_name in engine_cache:
-        engine_cache[event_db_name].dispose()
+    event_engines.dispose(event_db_name)
+    event_async_engines.dispose(event_db_name)
     
     # Database deletion
-    conn = psycopg2.connect(global_db_url)
-    conn.autocommit = True
-    with conn.cursor() as cur:
-        cur.execute(f"DROP DATABASE {event_db_name}")
-    conn.close()
+    event_db_provisioner.drop(event_db_name)
     
 def load_roles_from_csv(roles_csv_path: str):
     db = GlobalSessionLocal()
@@ -75,8 +88,16 @@ def load_roles_from_csv(roles_csv_path: str):
             db.refresh(role)
     db.close()
     
+def load_role_registry():
+    db = GlobalSessionLocal()
+    try:
+        role_registry.load(db)
+    finally:
+        db.close()
+    
 # Minio database
 def init_minio_db():
-    minio_db = get_minio_db()
-    if not minio_db.bucket_exists(settings.minio_bucket_name):
-        minio_db.make_bucket(settings.minio_bucket_name)
+    storage.backend.ensure_bucket()
+
+def close_minio_db():
+    storage.close()
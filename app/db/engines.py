@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.db.base import get_async_database_url
+from app.exceptions import ServerBusy
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class EventEngine:
+    """
+    Engine of an event database with its usage counters.
+    `in_use` is the number of sessions currently handed out, `peak_in_use` and `requests` are reset at each traffic window.
+    """
+    name: str
+    engine: Engine | AsyncEngine
+    session_maker: sessionmaker | async_sessionmaker
+    pool_size: int
+    last_used: float
+    window_start: float
+    in_use: int = 0
+    peak_in_use: int = 0
+    requests: int = 0
+    total_requests: int = 0
+    resizes: int = 0
+
+    @property
+    def pool(self):
+        return _pool(self.engine)
+
+def _pool(engine: Engine | AsyncEngine):
+    return getattr(engine, "sync_engine", engine).pool
+
+class EventEngineManager:
+    """
+    Manage the engines of the event databases.
+    - The sum of the pool sizes of all the event engines never exceeds `max_connections`: when the budget is reached,
+      the least recently used idle engines are disposed to make room, and a 503 is raised if none can be disposed.
+    - Each pool starts at `min_pool_size` and is resized according to the recent traffic of its event: it grows
+      (up to `max_pool_size`) when all its connections are in use and shrinks to the peak concurrency observed
+      during the last `traffic_window` seconds.
+    - Engines that have not been used for `idle_timeout` seconds are disposed. The pools are swept at each
+      `acquire` and by a background thread (see `start`), so that the engines idle after a burst are disposed even
+      when no event request follows.
+    Resizing a pool means replacing its engine: the new sessions use the new engine, and the previous one is
+    disposed once all its connections are returned. Until then, its checked out connections count against the budget.
+    """
+    def __init__(self, url_factory: Callable[[str], str], async_mode: bool = False, max_engines: int = 10, max_connections: int = 50,
+                 min_pool_size: int = 1, max_pool_size: int = 10, pool_timeout: float = 10, idle_timeout: float = 300, traffic_window: float = 60):
+        self.url_factory = url_factory
+        self.async_mode = async_mode
+        self.max_engines = max_engines
+        self.max_connections = max_connections
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max(min_pool_size, max_pool_size)
+        self.pool_timeout = pool_timeout
+        self.idle_timeout = idle_timeout
+        self.traffic_window = traffic_window
+
+        self._lock = threading.Lock()
+        self._engines: OrderedDict[str, EventEngine] = OrderedDict() # Least recently used first
+        self._allocated = 0
+        self._draining: list[Engine | AsyncEngine] = [] # Replaced engines with connections still checked out
+        self._loop: asyncio.AbstractEventLoop | None = None # Loop of the connections of the async engines
+        self._last_sweep = time.monotonic()
+        self._dispose_tasks = set()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    # Engine creation and disposal
+    def _create_engine(self, name: str, pool_size: int):
+        url = self.url_factory(name)
+        if self.async_mode:
+            engine = create_async_engine(url, pool_size=pool_size, max_overflow=0, pool_timeout=self.pool_timeout, pool_pre_ping=True)
+            return engine, async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        engine = create_engine(url, pool_size=pool_size, max_overflow=0, pool_timeout=self.pool_timeout, pool_pre_ping=True)
+        return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def _dispose_engine(self, engine: Engine | AsyncEngine):
+        if not isinstance(engine, AsyncEngine):
+            engine.dispose()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            task = loop.create_task(engine.dispose())
+            self._dispose_tasks.add(task)
+            task.add_done_callback(self._dispose_tasks.discard)
+        elif self._loop is not None and self._loop.is_running():
+            # Called from a thread (e.g. a background job): the connections are closed on their own loop
+            asyncio.run_coroutine_threadsafe(engine.dispose(), self._loop)
+        else:
+            # The loop of the connections is closed: they can only be dropped
+            engine.sync_engine.dispose(close=False)
+
+    # Connection budget (the caller must hold the lock)
+    def _used(self) -> int:
+        """Connections of the current pools and connections still checked out from the replaced engines."""
+        return self._allocated + sum(_pool(engine).checkedout() for engine in self._draining)
+
+    def _collect_drained(self, disposals: list):
+        if self._draining:
+            disposals.extend(engine for engine in self._draining if _pool(engine).checkedout() == 0)
+            self._draining = [engine for engine in self._draining if _pool(engine).checkedout() > 0]
+
+    def _evict(self, record: EventEngine, disposals: list):
+        del self._engines[record.name]
+        self._allocated -= record.pool_size
+        self.evictions += 1
+        disposals.append(record.engine)
+
+    def _reserve(self, pool_size: int, exclude: str, disposals: list) -> bool:
+        for record in list(self._engines.values()):
+            if self._used() + pool_size <= self.max_connections:
+                break
+            if record.name != exclude and record.in_use == 0:
+                self._evict(record, disposals)
+        return self._used() + pool_size <= self.max_connections
+
+    def _open(self, name: str, now: float, disposals: list) -> EventEngine:
+        if len(self._engines) >= self.max_engines:
+            for record in list(self._engines.values()):
+                if record.in_use == 0:
+                    self._evict(record, disposals)
+                    break
+        if len(self._engines) >= self.max_engines or not self._reserve(self.min_pool_size, name, disposals):
+            self.rejections += 1
+            raise ServerBusy("Too many event databases in use.")
+        engine, session_maker = self._create_engine(name, self.min_pool_size)
+        record = EventEngine(name=name, engine=engine, session_maker=session_maker, pool_size=self.min_pool_size, last_used=now, window_start=now)
+        self._engines[name] = record
+        self._allocated += record.pool_size
+        return record
+
+    def _resize(self, record: EventEngine, pool_size: int, disposals: list):
+        if pool_size > record.pool_size and not self._reserve(pool_size - record.pool_size, record.name, disposals):
+            pool_size = min(pool_size, record.pool_size + max(0, self.max_connections - self._used()))
+        if pool_size == record.pool_size:
+            return
+        self._draining.append(record.engine)
+        record.engine, record.session_maker = self._create_engine(record.name, pool_size)
+        self._allocated += pool_size - record.pool_size
+        record.pool_size = pool_size
+        record.resizes += 1
+
+    def _sweep(self, now: float, disposals: list):
+        self._last_sweep = now
+        self._collect_drained(disposals)
+        for record in list(self._engines.values()):
+            if record.in_use == 0 and now - record.last_used >= self.idle_timeout:
+                self._evict(record, disposals)
+            elif now - record.window_start >= self.traffic_window:
+                target = max(self.min_pool_size, min(self.max_pool_size, record.peak_in_use))
+                if target < record.pool_size and record.in_use == 0:
+                    self._resize(record, target, disposals)
+                record.window_start = now
+                record.peak_in_use = record.in_use
+                record.requests = 0
+
+    # Public API
+    def acquire(self, name: str) -> EventEngine:
+        """Get the engine of an event database and count a new session on it (to be given back with `release`)."""
+        disposals = []
+        if self.async_mode:
+            self._loop = asyncio.get_running_loop()
+        try:
+            with self._lock:
+                now = time.monotonic()
+                self._collect_drained(disposals)
+                if now - self._last_sweep >= min(self.traffic_window, self.idle_timeout):
+                    self._sweep(now, disposals)
+                record = self._engines.get(name)
+                if record is None:
+                    self.misses += 1
+                    record = self._open(name, now, disposals)
+                else:
+                    self.hits += 1
+                    self._engines.move_to_end(name)
+                record.in_use += 1
+                record.requests += 1
+                record.total_requests += 1
+                record.peak_in_use = max(record.peak_in_use, record.in_use)
+                record.last_used = now
+                if record.in_use > record.pool_size and record.pool_size < self.max_pool_size:
+                    self._resize(record, min(self.max_pool_size, 2 * record.pool_size), disposals)
+                return record
+        finally:
+            for engine in disposals:
+                self._dispose_engine(engine)
+
+    def release(self, record: EventEngine):
+        disposals = []
+        with self._lock:
+            record.in_use -= 1
+            record.last_used = time.monotonic()
+            self._collect_drained(disposals)
+        for engine in disposals:
+            self._dispose_engine(engine)
+
+    def sweep(self):
+        disposals = []
+        with self._lock:
+            self._sweep(time.monotonic(), disposals)
+        for engine in disposals:
+            self._dispose_engine(engine)
+
+    # Periodic sweep
+    def _run(self):
+        while not self._stopping.wait(min(self.traffic_window, self.idle_timeout)):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Could not sweep the event engines")
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=f"event-engines-sweep{'-async' if self.async_mode else ''}", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def dispose(self, name: str):
+        disposals = []
+        with self._lock:
+            if name in self._engines:
+                self._evict(self._engines[name], disposals)
+        for engine in disposals:
+            self._dispose_engine(engine)
+
+    def dispose_all(self):
+        with self._lock:
+            engines = [record.engine for record in self._engines.values()] + self._draining
+            self._engines.clear()
+            self._draining = []
+            self._allocated = 0
+        for engine in engines:
+            self._dispose_engine(engine)
+
+    async def adispose_all(self):
+        with self._lock:
+            engines = [record.engine for record in self._engines.values()] + self._draining
+            self._engines.clear()
+            self._draining = []
+            self._allocated = 0
+        for engine in engines:
+            await engine.dispose()
+        if self._dispose_tasks:
+            await asyncio.gather(*self._dispose_tasks, return_exceptions=True)
+
+    def pools(self) -> list[tuple[str, object]]:
+        with self._lock:
+            return [(record.name, record.pool) for record in self._engines.values()]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._engines
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "engines": len(self._engines),
+                "max_engines": self.max_engines,
+                "allocated_connections": self._allocated,
+                "draining_connections": self._used() - self._allocated,
+                "max_connections": self.max_connections,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+                "tenants": {
+                    record.name: {
+                        "pool_size": record.pool_size,
+                        "in_use": record.in_use,
+                        "checked_out": record.pool.checkedout(),
+                        "checked_in": record.pool.checkedin(),
+                        "peak_in_use": record.peak_in_use,
+                        "requests": record.requests,
+                        "total_requests": record.total_requests,
+                        "resizes": record.resizes,
+                        "idle_time": now - record.last_used, # [seconds]
+                    }
+                    for record in self._engines.values()
+                },
+            }
+
+_manager_settings = dict(
+    max_engines=settings.engine_cache_capacity,
+    max_connections=settings.event_db_max_connections,
+    min_pool_size=settings.event_db_min_pool_size,
+    max_pool_size=settings.event_db_max_pool_size,
+    pool_timeout=settings.event_db_pool_timeout,
+    idle_timeout=settings.event_db_idle_timeout,
+    traffic_window=settings.event_db_traffic_window,
+)
+event_engines = EventEngineManager(lambda name: f"{settings.database_url}/{name}", **_manager_settings)
+event_async_engines = EventEngineManager(get_async_database_url, async_mode=True, **_manager_settings)
@@ -0,0 +1,181 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable
+from sqlalchemy import JSON, Column, Float, Index, Integer, String, and_, delete, event, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.base import GlobalBase, GlobalSessionLocal
+
+logger = logging.getLogger(__name__)
+
+class JobSchema(GlobalBase):
+    """Background job: `kind` names its handler, which is called with the `payload` as keyword arguments."""
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_claim", "status", "run_at"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending") # "pending", "running" or "failed"
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_at = Column(Float, nullable=False) # [Unix timestamp] Not run before (backoff of the retries)
+    locked_until = Column(Float, nullable=True) # [Unix timestamp] End of the lease of the worker running it
+    last_error = Column(String, nullable=True)
+    created_at = Column(Float, nullable=False) # [Unix timestamp]
+
+# Handlers
+_handlers: dict[str, Callable[..., None]] = {}
+
+def job_handler(kind: str):
+    """Register the function running the jobs of a kind (it must be idempotent: a job can run more than once)."""
+    def register(function: Callable[..., None]) -> Callable[..., None]:
+        _handlers[kind] = function
+        return function
+    return register
+
+# Enqueueing (in the session of the change, so that the job is committed or rolled back with it)
+def enqueue(db: Session | AsyncSession, kind: str, delay: float = 0, **payload) -> JobSchema:
+    now = time.time()
+    job = JobSchema(kind=kind, payload=payload, status="pending", attempts=0, max_attempts=settings.job_max_attempts, run_at=now + delay, created_at=now)
+    db.add(job)
+    db.info["jobs_enqueued"] = True
+    return job
+
+@event.listens_for(Session, "after_commit")
+def _wake_up_workers(session: Session):
+    if session.info.pop("jobs_enqueued", False):
+        job_worker.notify()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_enqueued_jobs(session: Session):
+    session.info.pop("jobs_enqueued", None)
+
+class JobWorker:
+    """
+    Run the jobs of the jobs table in `threads` threads, in the API processes or in a standalone worker (app.worker).
+    - A thread claims the oldest due job: pending and past its `run_at`, or running with an expired lease (its
+      worker stopped). The candidates are selected FOR UPDATE SKIP LOCKED, so that the workers do not wait on each
+      other, and claimed by an update conditioned on the number of attempts seen, so that a job is never claimed
+      twice (also on SQLite, which has no row locks).
+    - A job that succeeds is deleted. A job that fails is retried after an exponential backoff (with jitter), and
+      kept with the "failed" status after `max_attempts` attempts.
+    - The threads poll every `poll_interval` seconds and are woken up at once by the commit of a job enqueued in
+      their process.
+    """
+    def __init__(self, threads: int, poll_interval: float, lease: float, backoff_base: float, backoff_max: float):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+        # Metrics
+        self.running = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    # Claim and completion
+    def _claim(self) -> tuple[int, str, dict, int, int] | None:
+        now = time.time()
+        with GlobalSessionLocal() as db:
+            due = or_(and_(JobSchema.status == "pending", JobSchema.run_at <= now), and_(JobSchema.status == "running", JobSchema.locked_until < now))
+            candidates = db.execute(select(JobSchema.id, JobSchema.attempts).where(due).order_by(JobSchema.run_at)
+                                    .limit(self.threads).with_for_update(skip_locked=True)).all()
+            for job_id, attempts in candidates:
+                claimed = db.execute(update(JobSchema).where(JobSchema.id == job_id, JobSchema.attempts == attempts)
+                                     .values(status="running", attempts=attempts + 1, locked_until=now + self.lease))
+                if claimed.rowcount == 1:
+                    job = db.execute(select(JobSchema.kind, JobSchema.payload, JobSchema.max_attempts).where(JobSchema.id == job_id)).one()
+                    db.commit()
+                    return job_id, job.kind, job.payload, attempts + 1, job.max_attempts
+            db.commit()
+        return None
+
+    def _complete(self, job_id: int, attempts: int, max_attempts: int, error: Exception | None):
+        claim = (JobSchema.id == job_id, JobSchema.attempts == attempts) # Not claimed again after the lease
+        with GlobalSessionLocal() as db:
+            if error is None:
+                db.execute(delete(JobSchema).where(*claim))
+                self.succeeded += 1
+            elif attempts >= max_attempts:
+                db.execute(update(JobSchema).where(*claim).values(status="failed", locked_until=None, last_error=repr(error)))
+                self.failed += 1
+            else:
+                backoff = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+                db.execute(update(JobSchema).where(*claim).values(status="pending", locked_until=None, run_at=time.time() + backoff, last_error=repr(error)))
+                self.retried += 1
+            db.commit()
+
+    def _execute(self, job_id: int, kind: str, payload: dict, attempts: int, max_attempts: int):
+        self.running += 1
+        error = None
+        try:
+            handler = _handlers.get(kind)
+            if handler is None:
+                raise LookupError(f"No handler for the jobs of kind {kind!r}")
+            handler(**payload)
+        except Exception as e:
+            error = e
+            logger.exception("Job %s (%s) failed, attempt %s of %s", job_id, kind, attempts, max_attempts)
+        finally:
+            self.running -= 1
+        self._complete(job_id, attempts, max_attempts, error)
+
+    def run_pending(self) -> int:
+        """Run the due jobs in the calling thread until there is none left and return their number."""
+        count = 0
+        while (job := self._claim()) is not None:
+            self._execute(*job)
+            count += 1
+        return count
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+                if job is not None:
+                    self._execute(*job)
+                    continue
+            except Exception:
+                logger.exception("Could not run the background jobs")
+            self._wakeup.wait(timeout=self.poll_interval)
+            self._wakeup.clear()
+
+    # Lifecycle
+    def notify(self):
+        self._wakeup.set()
+
+    def start(self):
+        self._stopping.clear()
+        while len(self._threads) < self.threads:
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        """Stop the threads once their current job is done."""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def stats(self) -> dict:
+        return {"threads": len(self._threads), "running": self.running, "succeeded": self.succeeded, "retried": self.retried, "failed": self.failed}
+
+job_worker = JobWorker(
+    threads=settings.job_worker_threads,
+    poll_interval=settings.job_poll_interval,
+    lease=settings.job_lease,
+    backoff_base=settings.job_backoff_base,
+    backoff_max=settings.job_backoff_max,
+)
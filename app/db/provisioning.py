@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import re
+import secrets
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import errors, sql
+from sqlalchemy import create_engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.core.config import settings
+from app.db.base import EventBase
+from app.exceptions import InvalidEventName
+
+logger = logging.getLogger(__name__)
+
+EVENT_DB_NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_]{0,62}$")
+
+def validate_event_db_name(event_db_name: str) -> str:
+    """
+    Event database names are used as identifiers (of a database or of a schema, see settings.event_tenancy): only
+    lowercase letters, digits and underscores are allowed, and the names of the system databases and schemas are reserved.
+    """
+    reserved = (settings.database_name, settings.event_db_template_name, "postgres", "template0", "template1", "public", "information_schema")
+    if (not EVENT_DB_NAME_PATTERN.match(event_db_name or "") or event_db_name in reserved
+            or event_db_name.startswith((settings.event_db_spare_prefix, "pg_"))):
+        raise InvalidEventName()
+    return event_db_name
+
+def event_schema_fingerprint() -> str:
+    """Hash of the DDL of the event tables, used to recognize the spare databases cloned from an older template."""
+    ddl = []
+    for table in EventBase.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table)))
+        ddl.extend(str(CreateIndex(index)) for index in sorted(table.indexes, key=lambda index: index.name or ""))
+    return hashlib.blake2b("\n".join(ddl).encode("utf-8"), digest_size=4).hexdigest()
+
+@contextmanager
+def _admin_connection():
+    # CREATE/ALTER/DROP DATABASE cannot run in a transaction
+    connection = psycopg2.connect(f"{settings.database_url}/{settings.database_name}")
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            yield cursor
+    finally:
+        connection.close()
+
+class EventDatabaseProvisioner:
+    """
+    Create the event databases by cloning a template database (CREATE DATABASE ... TEMPLATE) instead of creating
+    the tables of each new database.
+    - The template is created (EventBase.metadata.create_all) at startup, and recreated when the fingerprint of the
+      event tables stored in its comment differs.
+    - `pool_size` spare databases are cloned in advance: a new event database is a spare one renamed (a catalog
+      update), and the pool is refilled by a background thread.
+    - The spare databases are named after the fingerprint of the event tables: the ones cloned from an older
+      version of the template are dropped at startup.
+    """
+    def __init__(self, template_name: str, spare_prefix: str, pool_size: int):
+        self.template_name = template_name
+        self.spare_prefix = spare_prefix
+        self.pool_size = pool_size
+        self.fingerprint = event_schema_fingerprint()
+        self._refill = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # Metrics
+        self.spare_hits = 0
+        self.spare_misses = 0
+
+    @property
+    def spare_pattern(self) -> str:
+        return f"{self.spare_prefix}{self.fingerprint}_"
+
+    # Template
+    def ensure_template(self):
+        """
+        Create the template with the current event tables. Its fingerprint is stored as the comment of the database
+        once its tables are created: a template of an older version (or left incomplete) is dropped and recreated.
+        """
+        with _admin_connection() as cursor:
+            cursor.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s", (self.template_name,))
+            row = cursor.fetchone()
+            if row is not None and row[0] == self.fingerprint:
+                return
+            if row is not None:
+                logger.info("Recreating the event database template %s (fingerprint %s)", self.template_name, self.fingerprint)
+                cursor.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(self.template_name)))
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.template_name)))
+        template_engine = create_engine(f"{settings.database_url}/{self.template_name}")
+        try:
+            EventBase.metadata.create_all(bind=template_engine)
+        finally:
+            template_engine.dispose() # The template cannot be cloned while a connection is open on it
+        with _admin_connection() as cursor:
+            cursor.execute(sql.SQL("COMMENT ON DATABASE {} IS {}").format(sql.Identifier(self.template_name), sql.Literal(self.fingerprint)))
+
+    def _clone(self, cursor, database_name: str):
+        cursor.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(sql.Identifier(database_name), sql.Identifier(self.template_name)))
+
+    # Spare pool
+    def _list_spares(self, cursor) -> list[str]:
+        cursor.execute("SELECT datname FROM pg_database WHERE datname LIKE %s ORDER BY datname", (self.spare_prefix.replace("_", r"\_") + "%",))
+        return [row[0] for row in cursor.fetchall()]
+
+    def drop_outdated_spares(self):
+        with _admin_connection() as cursor:
+            for database_name in self._list_spares(cursor):
+                if not database_name.startswith(self.spare_pattern):
+                    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(database_name)))
+
+    def fill(self):
+        with _admin_connection() as cursor:
+            spares = [name for name in self._list_spares(cursor) if name.startswith(self.spare_pattern)]
+            for _ in range(self.pool_size - len(spares)):
+                if self._stopping.is_set():
+                    return
+                self._clone(cursor, f"{self.spare_pattern}{secrets.token_hex(4)}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.fill()
+            except Exception:
+                logger.exception("Could not refill the spare event databases")
+            self._refill.wait(timeout=settings.event_db_spare_refill_interval)
+            self._refill.clear()
+
+    # Lifecycle
+    def start(self):
+        self.fingerprint = event_schema_fingerprint() # All the event models are imported by now
+        self.ensure_template()
+        self.drop_outdated_spares()
+        if self.pool_size > 0 and self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="event-db-provisioner", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stopping.set()
+        self._refill.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Public API
+    def create(self, event_db_name: str):
+        """Create an event database, from a spare one when available (cloned from the template otherwise)."""
+        validate_event_db_name(event_db_name)
+        with _admin_connection() as cursor:
+            for spare_name in self._list_spares(cursor):
+                if not spare_name.startswith(self.spare_pattern):
+                    continue
+                try:
+                    cursor.execute(sql.SQL("ALTER DATABASE {} RENAME TO {}").format(sql.Identifier(spare_name), sql.Identifier(event_db_name)))
+                except (errors.InvalidCatalogName, errors.ObjectInUse):
+                    continue # Taken by another worker meanwhile
+                self.spare_hits += 1
+                break
+            else:
+                self.spare_misses += 1
+                self._clone(cursor, event_db_name)
+        self._refill.set()
+
+    def drop(self, event_db_name: str):
+        validate_event_db_name(event_db_name)
+        with _admin_connection() as cursor:
+            cursor.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(event_db_name)))
+
+    def stats(self) -> dict:
+        return {"pool_size": self.pool_size, "spare_hits": self.spare_hits, "spare_misses": self.spare_misses}
+
+event_db_provisioner = EventDatabaseProvisioner(
+    template_name=settings.event_db_template_name,
+    spare_prefix=settings.event_db_spare_prefix,
+    pool_size=settings.event_db_spare_pool_size,
+)
@@ -0,0 +1,195 @@
+import itertools
+import logging
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import settings
+from app.db.base import global_engine, global_async_engine, get_async_database_url, _pool_options
+
+logger = logging.getLogger(__name__)
+
+# Replication lag in seconds: 0 when the replica has replayed the WAL of the primary up to its position read before
+# the check (`primary_lsn`), otherwise the age of the last replayed transaction. NULL on a primary
+_POSTGRESQL_PRIMARY_LSN_QUERY = text("SELECT CAST(pg_current_wal_lsn() AS text)")
+_POSTGRESQL_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS pg_lsn) THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+class Replica:
+    def __init__(self, url: str):
+        database_url = f"{url}/{settings.database_name}"
+        self.name = url.rpartition("@")[2] # Without the credentials
+        self.engine = create_engine(database_url, pool_pre_ping=True, **_pool_options(database_url))
+        self.async_engine = create_async_engine(get_async_database_url(settings.database_name, url), pool_pre_ping=True, **_pool_options(url)) if settings.database_async else None
+        self.healthy = False # Until the first check
+        self.lag: float | None = None # [seconds]
+        self.reads = 0
+
+    def check(self, primary_lsn: str | None):
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == "postgresql":
+                    lag = connection.scalar(_POSTGRESQL_LAG_QUERY, {"primary_lsn": primary_lsn})
+                    self.lag = 0.0 if lag is None else float(lag)
+                else:
+                    connection.scalar(text("SELECT 1"))
+                    self.lag = 0.0
+            self.healthy = self.lag <= settings.database_replica_max_lag
+        except SQLAlchemyError as e:
+            if self.healthy:
+                logger.warning(f"Read replica {self.name} is down: {e}")
+            self.healthy = False
+            self.lag = None
+
+class ReplicaRouter:
+    """
+    Spread the reads of the read-only sessions across the replicas of the global database.
+    - The replicas are checked every `check_interval` seconds: the ones that are down or more than
+      `settings.database_replica_max_lag` seconds behind are skipped until they catch up. When no replica is
+      usable, the reads go to the primary.
+    - Read-your-own-writes: the keys (user emails) written recently are recorded, and the sessions reading them
+      are sent to the primary for `read_your_writes_window` seconds (see `prefer_primary`). The writes are only
+      known to the process that made them: the reads that must see the writes of any process (e.g. the login after
+      a password change) use the primary session instead.
+    """
+    def __init__(self, urls: list[str], check_interval: float, read_your_writes_window: float):
+        self.replicas = [Replica(url) for url in urls]
+        self.check_interval = check_interval
+        self.read_your_writes_window = read_your_writes_window
+        self._round_robin = itertools.count()
+        self._recent_writes: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # Metrics
+        self.primary_reads = 0
+        self.fallbacks = 0
+        self.read_your_writes = 0
+
+    # Health checks
+    def _primary_lsn(self) -> str | None:
+        """Current WAL position of the primary (None if unknown: the lag is then the age of the last replayed transaction)."""
+        if global_engine.dialect.name != "postgresql":
+            return None
+        try:
+            with global_engine.connect() as connection:
+                return connection.scalar(_POSTGRESQL_PRIMARY_LSN_QUERY)
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not read the WAL position of the primary: {e}")
+            return None
+
+    def check_all(self):
+        primary_lsn = self._primary_lsn() # Read first: the replicas are caught up if they have replayed up to it
+        for replica in self.replicas:
+            replica.check(primary_lsn)
+
+    def _run(self):
+        while not self._stopping.wait(self.check_interval):
+            self.check_all()
+
+    def start(self):
+        if not self.replicas or self._thread is not None:
+            return
+        self.check_all()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-health-check", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    async def adispose(self):
+        for replica in self.replicas:
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+
+    # Routing
+    def choose(self) -> Replica | None:
+        """Next healthy replica (round robin), None to read from the primary."""
+        if not self.replicas:
+            self.primary_reads += 1
+            return None
+        start = next(self._round_robin)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.healthy:
+                replica.reads += 1
+                return replica
+        self.primary_reads += 1
+        self.fallbacks += 1
+        return None
+
+    def record_writes(self, keys):
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._recent_writes[key] = now
+            if len(self._recent_writes) > 10000: # Forget the writes outside of the window
+                self._recent_writes = {key: written_at for key, written_at in self._recent_writes.items() if now - written_at < self.read_your_writes_window}
+
+    def recently_written(self, key: str) -> bool:
+        written_at = self._recent_writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes_window
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [{"name": replica.name, "healthy": replica.healthy, "lag": replica.lag, "reads": replica.reads} for replica in self.replicas],
+            "primary_reads": self.primary_reads,
+            "fallbacks": self.fallbacks,
+            "read_your_writes": self.read_your_writes,
+        }
+
+replica_router = ReplicaRouter(settings.database_replica_urls, settings.database_replica_check_interval, settings.database_read_your_writes_window)
+
+class ReadSession(Session):
+    """
+    Session of the read-only routes: its queries run on one replica chosen at the first query (the reads of the
+    session see the same snapshot of the replica). Once the session flushes, or when `prefer_primary` was called,
+    everything runs on the primary.
+    """
+    primary = global_engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs) -> Engine:
+        if self._flushing:
+            self.info["primary"] = True # The next reads of the session must see its writes
+        if self.info.get("primary"):
+            return self.primary
+        if "replica" not in self.info:
+            self.info["replica"] = replica_router.choose()
+        replica = self.info["replica"]
+        return self.primary if replica is None else self._replica_engine(replica)
+
+    def _replica_engine(self, replica: Replica) -> Engine:
+        return replica.engine
+
+class AsyncReadSession(ReadSession):
+    primary = global_async_engine.sync_engine if global_async_engine is not None else None
+
+    def _replica_engine(self, replica: Replica) -> Engine:
+        return replica.async_engine.sync_engine
+
+def prefer_primary(db: Session | AsyncSession, key: str):
+    """Read from the primary if `key` was written recently (before the first query of the session)."""
+    if replica_router.recently_written(key):
+        replica_router.read_your_writes += 1
+        db.info["primary"] = True
+
+GlobalReadSessionLocal = sessionmaker(class_=ReadSession, autocommit=False, autoflush=False)
+GlobalReadAsyncSessionLocal = async_sessionmaker(sync_session_class=AsyncReadSession, autoflush=False, expire_on_commit=False) if settings.database_async else None
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import io
+import threading
+import urllib3
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import AsyncIterator, Iterator
+from anyio import CapacityLimiter, from_thread, to_thread
+from minio import Minio
+from minio.error import S3Error
+
+from app.core.config import settings
+from app.db.jobs import job_handler
+
+def _no_such_key(object_name: str) -> S3Error:
+    return S3Error(response=None, code="NoSuchKey", message="The specified key does not exist.", resource=object_name, request_id="", host_id="", object_name=object_name)
+
+# Blocking backends
+class MinioBackend:
+    """
+    MinIO backend with a single client (and connection pool) for the whole process.
+    All the methods are blocking: use them from worker threads or through ObjectStorage.
+    """
+    blocking = True
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self.http_client = urllib3.PoolManager(
+            maxsize=settings.minio_pool_size,
+            block=False,
+            timeout=urllib3.Timeout(connect=settings.minio_connect_timeout, read=settings.minio_read_timeout),
+            retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        )
+        self.client = Minio(
+            endpoint=settings.minio_endpoint,
+            access_key=settings.minio_access_key,
+            secret_key=settings.minio_secret_key,
+            secure=settings.minio_secure,
+            http_client=self.http_client,
+        )
+
+    def ensure_bucket(self):
+        if not self.client.bucket_exists(self.bucket_name):
+            self.client.make_bucket(self.bucket_name)
+
+    def put_object(self, object_name: str, data, length: int, content_type: str, part_size: int = 0):
+        return self.client.put_object(self.bucket_name, object_name, data, length, content_type, part_size=part_size)
+
+    def get_object(self, object_name: str, offset: int = 0, length: int = 0):
+        return self.client.get_object(self.bucket_name, object_name, offset=offset, length=length)
+
+    def stat_object(self, object_name: str):
+        return self.client.stat_object(self.bucket_name, object_name)
+
+    def remove_object(self, object_name: str):
+        self.client.remove_object(self.bucket_name, object_name)
+
+    def presigned_get_object(self, object_name: str, expires: timedelta) -> str:
+        return self.client.presigned_get_object(self.bucket_name, object_name, expires=expires)
+
+    def close(self):
+        self.http_client.clear()
+
+@dataclass(frozen=True)
+class MemoryObject:
+    object_name: str
+    data: bytes
+    content_type: str
+    etag: str
+    last_modified: datetime
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+class MemoryObjectResponse(io.BytesIO):
+    """Same interface as the urllib3 response returned by Minio.get_object."""
+    def __init__(self, data: bytes, content_type: str):
+        super().__init__(data)
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(data))}
+
+    def stream(self, amt: int = 64 * 1024) -> Iterator[bytes]:
+        while chunk := self.read(amt):
+            yield chunk
+
+    def release_conn(self):
+        pass
+
+class MemoryBackend:
+    """In-memory backend with the same interface as MinioBackend, used by the tests and benchmarks."""
+    blocking = False
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self.objects: dict[str, MemoryObject] = {}
+        self._lock = threading.Lock()
+
+    def ensure_bucket(self):
+        pass
+
+    def put_object(self, object_name: str, data, length: int, content_type: str, part_size: int = 0):
+        content = data.read() if length < 0 else data.read(length)
+        with self._lock:
+            self.objects[object_name] = MemoryObject(object_name, content, content_type, hashlib.md5(content).hexdigest(), datetime.now(timezone.utc))
+        return self.objects[object_name]
+
+    def get_object(self, object_name: str, offset: int = 0, length: int = 0) -> MemoryObjectResponse:
+        stored_object = self.stat_object(object_name)
+        data = stored_object.data[offset:offset + length] if length else stored_object.data[offset:]
+        return MemoryObjectResponse(data, stored_object.content_type)
+
+    def stat_object(self, object_name: str) -> MemoryObject:
+        stored_object = self.objects.get(object_name)
+        if stored_object is None:
+            raise _no_such_key(object_name)
+        return stored_object
+
+    def remove_object(self, object_name: str):
+        with self._lock:
+            self.objects.pop(object_name, None)
+
+    def presigned_get_object(self, object_name: str, expires: timedelta) -> str:
+        return f"memory://{self.bucket_name}/{object_name}?expires={int(expires.total_seconds())}"
+
+    def close(self):
+        pass
+
+# Streaming uploads
+class _ChunkReader(io.RawIOBase):
+    """File-like object read by the backend in a worker thread and fed from the event loop through a queue."""
+    def __init__(self, queue: asyncio.Queue):
+        self._queue = queue
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            item = from_thread.run(self._queue.get)
+            if isinstance(item, BaseException):
+                raise item
+            if item is None:
+                self._eof = True
+            else:
+                self._buffer += item
+        size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+# Async service
+class ObjectStorage:
+    """
+    Object storage used by the application, shared by all the requests.
+    The async methods run the blocking calls of the backend in a dedicated pool of threads (limited to
+    `max_threads`) so that they never block the event loop nor take the threads of the sync routes.
+    The blocking backend is available as `storage.backend` for code already running in a worker thread.
+    """
+    def __init__(self, backend: MinioBackend | MemoryBackend, max_threads: int, part_size: int):
+        self.backend = backend
+        self.max_threads = max_threads
+        self.part_size = part_size
+        self._limiter: CapacityLimiter | None = None
+
+    async def run_sync(self, fn, *args, **kwargs):
+        if not self.backend.blocking:
+            return fn(*args, **kwargs)
+        if self._limiter is None:
+            self._limiter = CapacityLimiter(self.max_threads)
+        return await to_thread.run_sync(partial(fn, *args, **kwargs), limiter=self._limiter)
+
+    async def put_object(self, object_name: str, data: bytes, content_type: str):
+        return await self.run_sync(self.backend.put_object, object_name, io.BytesIO(data), len(data), content_type)
+
+    async def put_stream(self, object_name: str, chunks: AsyncIterator[bytes], content_type: str, max_buffered_chunks: int = 4):
+        """
+        Upload a stream with a multipart upload, without holding more than one part in memory.
+        If the stream raises (e.g. the file is too large), the upload is aborted and the exception is raised again.
+        """
+        if not self.backend.blocking:
+            data = b"".join([chunk async for chunk in chunks])
+            return self.backend.put_object(object_name, io.BytesIO(data), len(data), content_type)
+
+        queue = asyncio.Queue(maxsize=max_buffered_chunks)
+        upload = asyncio.ensure_future(self.run_sync(self.backend.put_object, object_name, _ChunkReader(queue), -1, content_type, part_size=self.part_size))
+
+        async def send(item):
+            # Stop waiting for room in the queue if the upload failed meanwhile
+            put = asyncio.ensure_future(queue.put(item))
+            await asyncio.wait({put, upload}, return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                put.cancel()
+                await upload
+
+        try:
+            async for chunk in chunks:
+                await send(chunk)
+        except BaseException as e:
+            await send(e)
+            try:
+                await upload
+            except BaseException:
+                pass
+            raise
+        await send(None)
+        return await upload
+
+    async def get_object(self, object_name: str, offset: int = 0, length: int = 0):
+        return await self.run_sync(self.backend.get_object, object_name, offset, length)
+
+    async def read_object(self, object_name: str) -> bytes:
+        response = await self.get_object(object_name)
+        try:
+            return await self.run_sync(response.read)
+        finally:
+            response.close()
+            response.release_conn()
+
+    async def stat_object(self, object_name: str):
+        return await self.run_sync(self.backend.stat_object, object_name)
+
+    async def remove_object(self, object_name: str):
+        await self.run_sync(self.backend.remove_object, object_name)
+
+    async def presigned_get_object(self, object_name: str, expires: timedelta) -> str:
+        return await self.run_sync(self.backend.presigned_get_object, object_name, expires)
+
+    def close(self):
+        self.backend.close()
+
+def _create_storage() -> ObjectStorage:
+    if settings.storage_backend == "memory":
+        backend = MemoryBackend(settings.minio_bucket_name)
+    elif settings.storage_backend == "minio":
+        backend = MinioBackend(settings.minio_bucket_name)
+    else:
+        raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+    return ObjectStorage(backend, max_threads=settings.minio_max_threads, part_size=settings.minio_part_size)
+
+storage = _create_storage()
+
+@job_handler("storage.remove_objects")
+def remove_objects(object_names: list[str]):
+    # Removing a missing object is not an error (S3 semantics), so that the job can be retried
+    for object_name in object_names:
+        storage.backend.remove_object(object_name)
@@ -0,0 +1,35 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import settings
+from app.db.base import global_engine, global_async_engine, EventBase
+from app.db.provisioning import validate_event_db_name
+
+# Schema-per-event tenancy (settings.event_tenancy = "schema", PostgreSQL only): each event is a schema of the
+# global database and its sessions use the connection pool of the global engine.
+
+def _quote(schema_name: str) -> str:
+    return global_engine.dialect.identifier_preparer.quote(validate_event_db_name(schema_name))
+
+class EventSchemaSession(Session):
+    """Session on the global database whose transactions run in the schema of an event (`info["event_schema"]`)."""
+
+@event.listens_for(EventSchemaSession, "after_begin")
+def _set_search_path(session: Session, transaction, connection):
+    # SET LOCAL only lasts until the end of the transaction: a pooled connection never keeps the schema of an event
+    schema_name = session.info.get("event_schema")
+    if schema_name:
+        connection.exec_driver_sql(f"SET LOCAL search_path TO {_quote(schema_name)}, public")
+
+EventSchemaSessionLocal = sessionmaker(class_=EventSchemaSession, autocommit=False, autoflush=False, bind=global_engine)
+EventSchemaAsyncSessionLocal = async_sessionmaker(bind=global_async_engine, sync_session_class=EventSchemaSession, autoflush=False, expire_on_commit=False) if settings.database_async else None
+
+def create_event_schema(schema_name: str):
+    with global_engine.begin() as connection:
+        connection.exec_driver_sql(f"CREATE SCHEMA {_quote(schema_name)}")
+        EventBase.metadata.create_all(bind=connection.execution_options(schema_translate_map={None: schema_name}))
+
+def drop_event_schema(schema_name: str):
+    with global_engine.begin() as connection:
+        connection.exec_driver_sql(f"DROP SCHEMA {_quote(schema_name)} CASCADE")
@@ -1,19 +1,25 @@
 import jwt
+from functools import lru_cache
 from typing import Annotated
-from minio import Minio
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 from fastapi.security import SecurityScopes, OAuth2PasswordBearer
 
-from app.db.base import GlobalSessionLocal
+from app.db.base import GlobalSessionLocal, GlobalAsyncSessionLocal
+from app.db.replicas import GlobalReadSessionLocal, GlobalReadAsyncSessionLocal
+from app.db.engines import event_engines, event_async_engines
+from app.db.storage import ObjectStorage, storage
+from app.db.provisioning import validate_event_db_name
+from app.db.tenancy import EventSchemaSessionLocal, EventSchemaAsyncSessionLocal
 from app.core.config import settings
-from app.helpers.cache import LRUCache
+from app.helpers.token_cache import VerifiedToken, VerifiedTokenCache
 from app.modules.user.models import TokenData, UserMailModel
+from app.modules.user.revocation import token_revocations
 from app.exceptions import CredentialsException
 
-engine_cache = LRUCache(settings.engine_cache_capacity)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
+token_cache = VerifiedTokenCache(settings.token_cache_capacity)
 
 def get_global_db():
     db = GlobalSessionLocal()
@@ -22,41 +28,69 @@ def get_global_db():
     finally:
         db.close()
 
+def get_global_read_db():
+    """Session for the read-only routes: the reads go to a replica when possible (see app.db.replicas)."""
+    db = GlobalReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 def get_event_db(event_db_name: str, db: Session = Depends(get_global_db)):
-    # Cache the engine for the event database
-    if event_db_name not in engine_cache:
-        # Check if the event database exists
-        # TODO: Implement this
-        
-        # Get the connection to the event database
-        event_db_url = f"{settings.database_url}/{event_db_name}"
-        event_engine = create_engine(event_db_url)
-        engine_cache[event_db_name] = sessionmaker(autocommit=False, autoflush=False, bind=event_engine)
-        
-    # Get the session to the event database
-    event_db = engine_cache[event_db_name]()
+    # Check if the event database exists
+    # TODO: Implement this
+    
+    validate_event_db_name(event_db_name)
+    if settings.event_tenancy == "schema":
+        # Schema of the event in the global database (see app.db.tenancy)
+        event_db = EventSchemaSessionLocal(info={"event_schema": event_db_name})
+        try:
+            yield event_db
+        finally:
+            event_db.close()
+        return
+    
+    # Get the session to the event database (engines are managed by app.db.engines)
+    event_engine = event_engines.acquire(event_db_name)
+    event_db = event_engine.session_maker()
     try:
         yield event_db
     finally:
         event_db.close()
+        event_engines.release(event_engine)
         
-def get_minio_db():
-    minio_client = Minio(
-        endpoint=settings.minio_endpoint,
-        access_key=settings.minio_access_key,
-        secret_key=settings.minio_secret_key,
-        secure=settings.minio_secure,
-    )
-    return minio_client
+# Async mode (see settings.database_async)
+async def get_global_async_db():
+    async with GlobalAsyncSessionLocal() as db:
+        yield db
         
-async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)]) -> UserMailModel:
-    # Format the scopes
-    if security_scopes.scopes:
-        authenticate_value = f"Bearer scope={security_scopes.scopes}"
+async def get_global_read_async_db():
+    async with GlobalReadAsyncSessionLocal() as db:
+        yield db
+
+async def get_event_async_db(event_db_name: str, db: AsyncSession = Depends(get_global_async_db)):
+    validate_event_db_name(event_db_name)
+    if settings.event_tenancy == "schema":
+        async with EventSchemaAsyncSessionLocal(info={"event_schema": event_db_name}) as event_db:
+            yield event_db
+        return
+    event_engine = event_async_engines.acquire(event_db_name)
+    try:
+        async with event_engine.session_maker() as event_db:
+            yield event_db
+    finally:
+        event_async_engines.release(event_engine)
         
-    # Add the "global:user" scope in the list of required scopes
-    security_scopes.scopes.append("global:user")
-    
+def get_storage() -> ObjectStorage:
+    # Shared client: its connection pool is reused by all the requests
+    return storage
+        
+@lru_cache(maxsize=256)
+def _get_required_scopes(scopes: tuple[str, ...]) -> frozenset[str]:
+    # The "global:user" scope is required on every route
+    return frozenset(scopes) | {"global:user"}
+
+def _verify_token(token: str, authenticate_value: str) -> VerifiedToken:
     # Decode the token and check if it is valid
     try:
         payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
@@ -67,10 +101,29 @@ async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str
         token_data = TokenData(email=email, roles=token_scopes)
     except jwt.InvalidTokenError:
         raise CredentialsException(authenticate_value, "Invalid token")
+    return VerifiedToken(user=UserMailModel(email=token_data.email), scopes=frozenset(token_data.roles), expires_at=payload.get("exp"),
+                         jti=payload.get("jti"), issued_at=payload.get("iat"))
+
+async def get_current_token(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)]) -> VerifiedToken:
+    # Format the scopes
+    authenticate_value = f'Bearer scope="{security_scopes.scope_str}"' if security_scopes.scopes else "Bearer"
+    
+    # Tokens already verified are served from the cache until their expiration
+    verified_token = token_cache.get(token)
+    if verified_token is None:
+        verified_token = _verify_token(token, authenticate_value)
+        if verified_token.expires_at is not None:
+            token_cache.put(token, verified_token)
+    
+    # Check if the token has been revoked (logout, password, email or role change, deletion of the user)
+    if await token_revocations.is_revoked(verified_token):
+        raise CredentialsException(authenticate_value, "Token revoked")
     
     # Check if the user has the required scopes
-    for scope in security_scopes.scopes:
-        if scope not in token_data.roles:
-            raise CredentialsException(authenticate_value, "Not enough permissions")
+    if not _get_required_scopes(tuple(security_scopes.scopes)) <= verified_token.scopes:
+        raise CredentialsException(authenticate_value, "Not enough permissions")
     
-    return UserMailModel(email=token_data.email)
\ No newline at end of file
+    return verified_token
+
+async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)]) -> UserMailModel:
+    return (await get_current_token(security_scopes, token)).user
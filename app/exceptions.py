@@ -34,4 +34,23 @@ class ImageNotFound(HTTPException):
         
 class InvalidRole(HTTPException):
     def __init__(self):
-        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid role.")
\ No newline at end of file
+        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid role.")
+        
+class ServerBusy(HTTPException):
+    def __init__(self, detail: str = "", retry_after: int = 1):
+        detail_str = "Server busy, please retry later."
+        if detail:
+            detail_str += f" {detail}"
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail_str, headers={"Retry-After": str(retry_after)})
+
+class TooManyRequests(HTTPException):
+    def __init__(self, retry_after: int = 1):
+        super().__init__(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests, please retry later.", headers={"Retry-After": str(retry_after)})
+
+class InvalidCursor(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid pagination cursor.")
+
+class InvalidEventName(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid event name (lowercase letters, digits and underscores only).")
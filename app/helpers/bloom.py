@@ -0,0 +1,44 @@
+import math
+
+class BloomFilter:
+    """
+    Set membership with false positives (at a rate of about `error_rate` once `capacity` items are added) and no
+    false negatives, in `-capacity * ln(error_rate) / ln(2)^2` bits.
+    The `hash_count` bit positions of an item are derived from the two halves of its 64-bit `hash()` (double
+    hashing): the filter only lives in the memory of one process, so the randomization of `hash()` between the
+    processes does not matter, and the hash of a string is computed once and cached by the string.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)) # [bits]
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @staticmethod
+    def _hashes(item: str) -> tuple[int, int]:
+        item_hash = hash(item) & 0xFFFFFFFFFFFFFFFF
+        return item_hash & 0xFFFFFFFF, (item_hash >> 32) | 1
+
+    def add(self, item: str):
+        first, second = self._hashes(item)
+        for index in range(self.hash_count):
+            position = (first + index * second) % self.size
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        # Stops at the first unset bit: about one probe for an item that was not added
+        first, second = self._hashes(item)
+        bits, size = self._bits, self.size
+        for index in range(self.hash_count):
+            position = (first + index * second) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def full(self) -> bool:
+        """More items than the capacity: the false positive rate is above `error_rate`."""
+        return self.count > self.capacity
@@ -1,22 +1,223 @@
+import asyncio
+import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
 
-class LRUCache(OrderedDict):
-    def __init__(self, capacity: int):
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class _LoadAbandoned(Exception):
+    """The loader was interrupted (e.g. its request was cancelled): the waiting callers load the value themselves."""
+
+class _Entry:
+    __slots__ = ("value", "weight", "expires_at")
+
+    def __init__(self, value, weight: int, expires_at: float | None):
+        self.value = value
+        self.weight = weight
+        self.expires_at = expires_at # time.monotonic() timestamp, None if the entry does not expire
+
+class TTLCache(Generic[K, V]):
+    """
+    Bounded LRU cache, safe to share between threads and coroutines (the lock is never held across an await).
+    - Each entry expires `ttl` seconds after it is stored (the default of the cache or the one given to `put`).
+    - The capacity is a total weight: `weigher(value)` (1 by default) is counted for each entry, the least recently
+      used entries are evicted to make room and a value heavier than the whole capacity is not stored.
+    - `on_evict(key, value)` is called (outside of the lock) for every entry leaving the cache: evicted, expired,
+      invalidated, replaced or cleared, e.g. to release the resources it holds.
+    - `get_or_load` and `aget_or_load` are single-flight: for a missing key, only one caller runs the loader and the
+      concurrent callers (threads or coroutines) wait for its result. The value of a load is not stored if the key
+      is invalidated meanwhile, so that a concurrent write is never hidden by the value read before it.
+    """
+    def __init__(self, capacity: int, ttl: float | None = None, weigher: Callable[[V], int] | None = None,
+                 on_evict: Callable[[K, V], Any] | None = None):
         self.capacity = capacity
-        super().__init__()
-        
-    def __getitem__(self, key):
-        value = super().__getitem__(key)
-        self.move_to_end(key)
+        self.ttl = ttl
+        self.weigher = weigher
+        self.on_evict = on_evict
+        self._entries: OrderedDict[K, _Entry] = OrderedDict() # Least recently used first
+        self._loading: dict[K, Future] = {}
+        self._weight = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_waits = 0 # Callers served by the load of another caller
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # Internals (the caller must hold the lock)
+    def _lookup(self, key: K, removed: list) -> _Entry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and time.monotonic() >= entry.expires_at:
+            self._remove(key, removed)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: K, removed: list) -> _Entry:
+        entry = self._entries.pop(key)
+        self._weight -= entry.weight
+        removed.append((key, entry.value))
+        return entry
+
+    def _store(self, key: K, value: V, ttl: float | None, removed: list):
+        weight = self.weigher(value) if self.weigher else 1
+        if key in self._entries:
+            self._remove(key, removed)
+        if weight > self.capacity:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = _Entry(value, weight, None if ttl is None else time.monotonic() + ttl)
+        self._weight += weight
+        while self._weight > self.capacity:
+            self._remove(next(iter(self._entries)), removed)
+            self.evictions += 1
+
+    def _notify(self, removed: list):
+        if removed and self.on_evict:
+            for key, value in removed:
+                self.on_evict(key, value)
+
+    # Public API
+    def get(self, key: K, default=None) -> V | None:
+        removed = []
+        with self._lock:
+            entry = self._lookup(key, removed)
+            if entry is not None:
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+        self._notify(removed)
+        return default
+
+    def put(self, key: K, value: V, ttl: float | None = None):
+        removed = []
+        with self._lock:
+            self._store(key, value, ttl, removed)
+        self._notify(removed)
+
+    def invalidate(self, *keys: K):
+        """Remove the keys and discard the value of their loads in progress."""
+        removed = []
+        with self._lock:
+            for key in keys:
+                self._loading.pop(key, None)
+                if key in self._entries:
+                    self._remove(key, removed)
+                    self.invalidations += 1
+        self._notify(removed)
+
+    def clear(self):
+        with self._lock:
+            removed = [(key, entry.value) for key, entry in self._entries.items()]
+            self._entries.clear()
+            self._loading.clear()
+            self._weight = 0
+        self._notify(removed)
+
+    # Single-flight loading
+    def _begin_load(self, key: K) -> tuple[V | None, Future | None, bool]:
+        """Return the cached value (hit), or the future of the load and whether the caller has to run the loader."""
+        removed = []
+        with self._lock:
+            entry = self._lookup(key, removed)
+            if entry is not None:
+                self.hits += 1
+                return entry.value, None, False
+            self.misses += 1
+            future = self._loading.get(key)
+            if future is None:
+                future = self._loading[key] = Future()
+                self.loads += 1
+                is_loader = True
+            else:
+                self.load_waits += 1
+                is_loader = False
+        self._notify(removed)
+        return None, future, is_loader
+
+    def _end_load(self, key: K, future: Future, value: V, ttl: float | None):
+        removed = []
+        with self._lock:
+            if self._loading.get(key) is future: # Not invalidated during the load
+                del self._loading[key]
+                self._store(key, value, ttl, removed)
+        future.set_result(value)
+        self._notify(removed)
+
+    def _fail_load(self, key: K, future: Future, error: BaseException):
+        with self._lock:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+        future.set_exception(error if isinstance(error, Exception) else _LoadAbandoned())
+
+    def get_or_load(self, key: K, loader: Callable[[], V], ttl: float | None = None) -> V:
+        while True:
+            value, future, is_loader = self._begin_load(key)
+            if future is None:
+                return value
+            if is_loader:
+                break
+            try:
+                return future.result()
+            except _LoadAbandoned:
+                continue
+        try:
+            value = loader()
+        except BaseException as error:
+            self._fail_load(key, future, error)
+            raise
+        self._end_load(key, future, value, ttl)
         return value
-    
-    def __setitem__(self, key, value):
-        if key in self:
-            self.move_to_end(key)
-        super().__setitem__(key, value)
-        if len(self) > self.capacity:
-            removed_item = self.popitem(last=False)
-            
-            # Disppose removed item to free resources
-            if hasattr(removed_item[1], "dispose"):
-                removed_item[1].dispose()
\ No newline at end of file
+
+    async def aget_or_load(self, key: K, loader: Callable[[], Awaitable[V]], ttl: float | None = None) -> V:
+        while True:
+            value, future, is_loader = self._begin_load(key)
+            if future is None:
+                return value
+            if is_loader:
+                break
+            try:
+                # Shielded: the cancellation of a waiting caller must not cancel the load of the others
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LoadAbandoned:
+                continue
+        try:
+            value = await loader()
+        except BaseException as error:
+            self._fail_load(key, future, error)
+            raise
+        self._end_load(key, future, value, ttl)
+        return value
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry.expires_at is None or time.monotonic() < entry.expires_at)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "weight": self._weight,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "load_waits": self.load_waits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
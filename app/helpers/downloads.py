@@ -0,0 +1,107 @@
+import re
+import time
+from email.utils import format_datetime
+from typing import Iterator
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
+
+from app.helpers.cache import TTLCache
+
+CHUNK_SIZE = 64 * 1024 # [bytes]
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class PresignedUrlCache:
+    """
+    Bounded cache of presigned URLs, each one served until `margin` seconds before it expires.
+    The object keys are unique per upload, so a URL stays valid for its key until it expires.
+    """
+    def __init__(self, capacity: int, margin: float):
+        self.capacity = capacity
+        self.margin = margin
+        self._cache: TTLCache[tuple, tuple[str, float]] = TTLCache(capacity)
+
+    def get(self, key: tuple) -> tuple[str, float] | None:
+        """Return the URL and the number of seconds it can still be used (before the renewal margin)."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        url, expires_at = entry
+        return url, expires_at - time.time() - self.margin
+
+    def put(self, key: tuple, url: str, expires_in: float):
+        self._cache.put(key, (url, time.time() + expires_in), ttl=expires_in - self.margin)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+# Conditional and range requests
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single "bytes=" range into inclusive (start, end) offsets.
+    Return None when the whole object must be sent and raise ValueError when the range is not satisfiable.
+    """
+    if not range_header:
+        return None
+    match = _RANGE_PATTERN.match(range_header.strip())
+    if not match or match.groups() == ("", ""):
+        return None # Invalid or multiple ranges are ignored (the whole object is sent)
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last `end` bytes
+        if int(end) == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - int(end)), size - 1
+    start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+def iter_object(response, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Stream a MinIO response and give its connection back to the pool, even if the client disconnects."""
+    try:
+        yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
+
+def object_response(open_object, stat, headers: Headers, extra_headers: dict | None = None) -> Response:
+    """
+    Build the response of a stored object with ETag/If-None-Match (304) and Range (206) support.
+    `open_object(offset, length)` is only called when bytes have to be sent.
+    """
+    etag = f'"{stat.etag}"'
+    response_headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        **(extra_headers or {}),
+    }
+    if stat.last_modified:
+        response_headers["Last-Modified"] = format_datetime(stat.last_modified, usegmt=True)
+    if etag_matches(headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=response_headers)
+
+    # A range is only applied if the client still has the same version of the object
+    range_header = headers.get("range")
+    if_range = headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.size)
+    except ValueError:
+        return Response(status_code=416, headers={**response_headers, "Content-Range": f"bytes */{stat.size}"})
+
+    if byte_range is None:
+        response_headers["Content-Length"] = str(stat.size)
+        return StreamingResponse(iter_object(open_object(0, 0)), media_type=stat.content_type, headers=response_headers)
+    start, end = byte_range
+    response_headers["Content-Length"] = str(end - start + 1)
+    response_headers["Content-Range"] = f"bytes {start}-{end}/{stat.size}"
+    return StreamingResponse(iter_object(open_object(start, end - start + 1)), status_code=206, media_type=stat.content_type, headers=response_headers)
@@ -0,0 +1,74 @@
+import asyncio
+import io
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+
+# Formats of the profile picture variants: extension -> (Pillow format, content type)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+def variant_key(key: str, size: int, extension: str) -> str:
+    """Key of a variant stored next to the original image, e.g. "user/picture_48.webp" for "user/picture.png"."""
+    base = key.rsplit(".", 1)[0]
+    return f"{base}_{size}.{extension}"
+
+def variant_keys(key: str, sizes: list[int]) -> list[str]:
+    return [variant_key(key, size, extension) for size in sizes for extension in VARIANT_FORMATS]
+
+def select_variant_size(sizes: list[int], requested_size: int) -> int | None:
+    """Smallest variant at least as large as the requested size (None for the original if all are smaller)."""
+    larger_sizes = [size for size in sizes if size >= requested_size]
+    return min(larger_sizes) if larger_sizes else None
+
+# Rendering (module level to be picklable by the process pool)
+def render_variants(image_data: bytes, sizes: list[int], quality: int) -> dict[tuple[int, str], bytes]:
+    """Render square variants of an image for each size and format, largest first to reuse the downscaled image."""
+    variants = {}
+    with Image.open(io.BytesIO(image_data)) as image:
+        image.draft("RGB", (max(sizes), max(sizes))) # Faster JPEG decoding at a reduced scale
+        source = ImageOps.exif_transpose(image).convert("RGB")
+    for size in sorted(set(sizes), reverse=True):
+        source = ImageOps.fit(source, (size, size), method=Image.Resampling.LANCZOS)
+        for extension, (image_format, _) in VARIANT_FORMATS.items():
+            buffer = io.BytesIO()
+            source.save(buffer, format=image_format, quality=quality, optimize=True)
+            variants[(size, extension)] = buffer.getvalue()
+    return variants
+
+class ImageProcessor:
+    """Process pool used to render the image variants outside of the event loop and of the request threads."""
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, image_data: bytes, sizes: list[int], quality: int) -> Future:
+        if self._executor is None:
+            self.start()
+        return self._executor.submit(render_variants, image_data, sizes, quality)
+
+    async def render_variants(self, image_data: bytes, sizes: list[int], quality: int) -> dict[tuple[int, str], bytes]:
+        return await asyncio.wrap_future(self._submit(image_data, sizes, quality))
+
+    def render_variants_blocking(self, image_data: bytes, sizes: list[int], quality: int) -> dict[tuple[int, str], bytes]:
+        """Render in the process pool and wait for the result (from the threads of the background jobs)."""
+        return self._submit(image_data, sizes, quality).result()
+
+image_processor = ImageProcessor(settings.image_workers)
@@ -1,11 +1,196 @@
 import logging
 import json
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from app.core.config import settings
 
+try:
+    import orjson
+except ImportError: # Optional: the standard encoder is used if orjson is not installed
+    orjson = None
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str, separators=(",", ":"))
+
 class StructuredLogger(logging.Logger):
+    """
+    Logger accepting dicts as messages. The dict is kept as is in the record and only serialized by the
+    JsonFormatter, in the thread of the QueueListener (not in the request).
+    """
     def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False):
         if extra is None:
             extra = {}
         extra['app_name'] = settings.app_name
-        super()._log(level, json.dumps(msg) if isinstance(msg, dict) else msg, args, exc_info, extra, stack_info)
+        super()._log(level, msg, args, exc_info, extra, stack_info)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: the fields of the dict messages are merged with the metadata of the record."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "app_name": getattr(record, "app_name", settings.app_name),
+        }
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return dumps(entry)
+
+# Pipeline
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Put the records in a bounded queue without formatting them (the listener does it).
+    When the queue is full, the records are dropped (and counted) instead of blocking the request.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The dict messages are immutable once logged, the other ones are rendered now (their args may change)
+        if not isinstance(record.msg, dict) and record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler writing a batch of records with a single write and flush."""
+    def emit_batch(self, records: list[logging.LogRecord]):
+        try:
+            data = "".join(self.format(record) + self.terminator for record in records)
+            self.acquire()
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes > 0 and self.stream.tell() + len(data) > self.maxBytes and self.stream.tell() > 0:
+                    self.doRollover()
+                    if self.stream is None: # Not reopened by doRollover when the handler is delayed
+                        self.stream = self._open()
+                self.stream.write(data)
+                self.stream.flush()
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(records[-1])
+
+class BatchQueueListener(QueueListener):
+    """QueueListener giving the records to the handlers by batches of at most `batch_size` records."""
+    def __init__(self, log_queue: queue.Queue, *handlers, batch_size: int = 256):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.batches = 0
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel) # Wait for room in the queue instead of raising queue.Full
+
+    def _monitor(self):
+        stop = False
+        while not stop:
+            records = [self.dequeue(True)]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            if records[-1] is self._sentinel:
+                records.pop()
+                stop = True
+            elif self._sentinel in records:
+                records.remove(self._sentinel)
+                stop = True
+            if records:
+                self.handle_batch(records)
+            for _ in range(len(records) + stop):
+                self.queue.task_done()
+
+    def handle_batch(self, records: list[logging.LogRecord]):
+        self.batches += 1
+        for handler in self.handlers:
+            accepted = [record for record in records if record.levelno >= handler.level]
+            if not accepted:
+                continue
+            if hasattr(handler, "emit_batch"):
+                handler.emit_batch(accepted)
+            else:
+                for record in accepted:
+                    handler.handle(record)
+
+class LoggingPipeline:
+    """
+    Non-blocking logging: the loggers only put the records in a queue, a background thread formats them to JSON
+    and writes them to the rotating log file by batches.
+    """
+    def __init__(self, logger: logging.Logger, file_path: str, max_bytes: int, backup_count: int, queue_size: int, batch_size: int):
+        self.file_path = file_path
+        self.file_handler = BatchRotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.file_handler.setFormatter(JsonFormatter())
+        self.queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.listener = BatchQueueListener(self.queue_handler.queue, self.file_handler, batch_size=batch_size)
+        self._lock = threading.Lock()
+        self._running = False
+        logger.addHandler(self.queue_handler)
+
+    def start(self, clear: bool = False):
+        with self._lock:
+            if self._running:
+                return
+            if clear:
+                with open(self.file_path, "w"): # Clear the log file
+                    pass
+            self.listener.start()
+            self._running = True
+
+    def stop(self):
+        # Write the records still in the queue before returning
+        with self._lock:
+            if not self._running:
+                return
+            self.listener.stop()
+            self.file_handler.close()
+            self._running = False
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "batches": self.listener.batches,
+        }
+
+# Request logging
+def filter_headers(headers, allowed: list[str], redacted: list[str]) -> dict:
+    """
+    Keep only the allowed headers ("*" for all of them) and hide the value of the redacted ones.
+    For the Authorization header, the scheme is kept (e.g. "Bearer [REDACTED]").
+    """
+    allow_all = "*" in allowed
+    allowed, redacted = {name.lower() for name in allowed}, {name.lower() for name in redacted}
+    filtered = {}
+    for name, value in headers.items():
+        if not allow_all and name not in allowed:
+            continue
+        if name in redacted:
+            scheme = value.split(" ", 1)[0] if name == "authorization" and " " in value else ""
+            value = f"{scheme} [REDACTED]".lstrip()
+        filtered[name] = value
+    return filtered
+
+def should_log_request(status_code: int, process_time: float) -> bool:
+    """Errors and slow requests are always logged, the other ones are sampled."""
+    if status_code >= 400 or process_time >= settings.log_slow_request_threshold:
+        return True
+    return settings.log_success_sample_rate >= 1 or random.random() < settings.log_success_sample_rate
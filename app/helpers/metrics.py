@@ -0,0 +1,222 @@
+import time
+from bisect import bisect_left
+from typing import Callable
+
+from app.db.base import global_engine
+from app.db.jobs import job_worker
+from app.db.engines import event_engines, event_async_engines
+from app.db.provisioning import event_db_provisioner
+from app.db.replicas import replica_router
+from app.dependencies import token_cache
+from app.helpers.passwords import password_hasher
+from app.helpers.throttle import auth_throttle
+from app.modules.user.cache import user_cache
+from app.modules.user.revocation import token_revocations
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # [seconds]
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class HttpMetrics:
+    """
+    Latency histograms per (method, route, status) and in-flight requests.
+    Only updated and read from the event loop (by the middleware and the /metrics route), so no lock is needed.
+    """
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.in_flight = 0
+        self.histograms: dict[tuple[str, str, str], list] = {} # labels -> [bucket counts..., sum, count]
+
+    def observe(self, method: str, route: str, status: int, duration: float):
+        key = (method, route, str(status))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        histogram[bisect_left(self.buckets, duration)] += 1
+        histogram[-2] += duration
+        histogram[-1] += 1
+
+http_metrics = HttpMetrics()
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no request/response objects are built) timing every HTTP request."""
+    def __init__(self, app, metrics: HttpMetrics = http_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            # Route template (e.g. "/users/{user_id}") to keep the number of series bounded
+            route = scope.get("route")
+            self.metrics.observe(scope["method"], getattr(route, "path", "unmatched"), status, time.perf_counter() - start_time)
+
+# Prometheus text format
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+class MetricsWriter:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name: str, metric_type: str, help_text: str, samples: list[tuple[dict, float]]):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, series: list[tuple[dict, tuple[float, ...], list[int], float, int]]):
+        """`series` items are (labels, bucket bounds, non-cumulative bucket counts with +Inf last, sum, count)."""
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, bounds, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                self.lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {total}")
+            self.lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+# Collectors (called when /metrics is scraped)
+def _collect_http(writer: MetricsWriter):
+    writer.metric("http_requests_in_flight", "gauge", "Requests currently being handled.", [({}, http_metrics.in_flight)])
+    writer.histogram("http_request_duration_seconds", "Latency of the HTTP requests by route and status.", [
+        ({"method": method, "route": route, "status": status}, http_metrics.buckets, histogram[:-2], histogram[-2], histogram[-1])
+        for (method, route, status), histogram in list(http_metrics.histograms.items())
+    ])
+
+def _pool_samples(database: str, pool) -> dict[str, tuple[dict, float]]:
+    labels = {"database": database}
+    samples = {
+        gauge: (labels, getattr(pool, gauge)())
+        for gauge in ("size", "checkedout", "checkedin", "overflow")
+        if hasattr(pool, gauge) # Not all the pool classes have these gauges (e.g. the SQLite ones)
+    }
+    if "overflow" in samples:
+        samples["overflow"] = (labels, max(0, samples["overflow"][1])) # Negative while the pool is not full
+    return samples
+
+def _collect_pools(writer: MetricsWriter):
+    pools = [("global", global_engine.pool)]
+    for manager in (event_engines, event_async_engines):
+        pools += manager.pools()
+    samples = [_pool_samples(name, pool) for name, pool in pools]
+    for gauge, help_text in (("size", "Size of the connection pool."),
+                             ("checkedout", "Connections checked out of the pool."),
+                             ("checkedin", "Idle connections in the pool."),
+                             ("overflow", "Connections opened above the pool size.")):
+        writer.metric(f"db_pool_{gauge}", "gauge", help_text, [sample[gauge] for sample in samples if gauge in sample])
+
+def _collect_engine_cache(writer: MetricsWriter):
+    series = {"hits": [], "misses": [], "evictions": [], "rejections": []}
+    gauges = {"engines": [], "allocated_connections": [], "draining_connections": []}
+    for mode, manager in (("sync", event_engines), ("async", event_async_engines)):
+        stats = manager.stats()
+        for name in series:
+            series[name].append(({"mode": mode}, stats[name]))
+        for name in gauges:
+            gauges[name].append(({"mode": mode}, stats[name]))
+    for name, samples in series.items():
+        writer.metric(f"engine_cache_{name}_total", "counter", f"Event engine cache {name}.", samples)
+    writer.metric("engine_cache_engines", "gauge", "Event engines currently open.", gauges["engines"])
+    writer.metric("engine_cache_allocated_connections", "gauge", "Connections allocated to the event engines.", gauges["allocated_connections"])
+    writer.metric("engine_cache_draining_connections", "gauge", "Connections still checked out from the replaced event engines.", gauges["draining_connections"])
+
+def _collect_provisioner(writer: MetricsWriter):
+    stats = event_db_provisioner.stats()
+    writer.metric("event_db_spare_hits_total", "counter", "Event databases created from a spare database.", [({}, stats["spare_hits"])])
+    writer.metric("event_db_spare_misses_total", "counter", "Event databases cloned on demand (no spare database).", [({}, stats["spare_misses"])])
+
+def _collect_replicas(writer: MetricsWriter):
+    stats = replica_router.stats()
+    replicas = stats["replicas"]
+    writer.metric("db_replica_healthy", "gauge", "1 when the replica is up and within the maximum lag.", [({"replica": replica["name"]}, int(replica["healthy"])) for replica in replicas])
+    writer.metric("db_replica_lag_seconds", "gauge", "Replication lag measured by the last check.", [({"replica": replica["name"]}, replica["lag"]) for replica in replicas if replica["lag"] is not None])
+    writer.metric("db_replica_reads_total", "counter", "Read sessions sent to the replica.", [({"replica": replica["name"]}, replica["reads"]) for replica in replicas])
+    writer.metric("db_primary_reads_total", "counter", "Read sessions sent to the primary.", [({}, stats["primary_reads"])])
+    writer.metric("db_replica_fallbacks_total", "counter", "Read sessions sent to the primary because no replica was usable.", [({}, stats["fallbacks"])])
+    writer.metric("db_read_your_writes_total", "counter", "Read sessions sent to the primary because the user was written recently.", [({}, stats["read_your_writes"])])
+
+def _collect_password_hasher(writer: MetricsWriter):
+    stats = password_hasher.stats()
+    bounds = tuple(bound for bound in stats["latency_buckets"] if bound != float("inf"))
+    writer.histogram("password_hash_duration_seconds", "Duration of the bcrypt hashes and checks (queueing included).",
+                     [({}, bounds, list(stats["latency_buckets"].values()), stats["latency_sum"], stats["completed"])])
+    writer.metric("password_hash_queue_depth", "gauge", "Hashes waiting for or running on a worker.", [({}, stats["queue_depth"])])
+    writer.metric("password_hash_rejected_total", "counter", "Hashes rejected because the queue was full.", [({}, stats["rejected"])])
+
+def _collect_token_cache(writer: MetricsWriter):
+    stats = token_cache.stats()
+    writer.metric("token_cache_size", "gauge", "Verified tokens in the cache.", [({}, stats["size"])])
+    for name in ("hits", "misses", "expirations", "evictions"):
+        writer.metric(f"token_cache_{name}_total", "counter", f"Token cache {name}.", [({}, stats[name])])
+
+def _collect_throttle(writer: MetricsWriter):
+    stats = auth_throttle.stats()
+    writer.metric("throttle_keys", "gauge", "Token buckets kept in memory.", [({"limiter": name}, limiter["size"]) for name, limiter in stats.items()])
+    for name in ("allowed", "rejected", "evictions"):
+        writer.metric(f"throttle_{name}_total", "counter", f"Throttled requests {name}.", [({"limiter": limiter_name}, limiter[name]) for limiter_name, limiter in stats.items()])
+
+def _collect_user_cache(writer: MetricsWriter):
+    stats = user_cache.stats()
+    writer.metric("user_cache_size", "gauge", "Users in the read cache.", [({}, stats["size"])])
+    for name in ("hits", "misses", "invalidations"):
+        writer.metric(f"user_cache_{name}_total", "counter", f"User cache {name}.", [({}, stats[name])])
+    lookups = stats["hits"] + stats["misses"]
+    writer.metric("user_cache_hit_ratio", "gauge", "Fraction of the lookups served by the user cache.", [({}, stats["hits"] / lookups if lookups else 0.0)])
+
+def _collect_token_revocations(writer: MetricsWriter):
+    stats = token_revocations.stats()
+    writer.metric("token_revocation_bloom_items", "gauge", "Revoked tokens in the Bloom filter.", [({}, stats["bloom_items"])])
+    writer.metric("token_revocation_users", "gauge", "Users with a \"tokens valid after\" timestamp.", [({}, stats["users"])])
+    for name in ("checks", "bloom_positives", "revoked"):
+        writer.metric(f"token_revocation_{name}_total", "counter", f"Token revocation {name.replace('_', ' ')}.", [({}, stats[name])])
+
+def _collect_jobs(writer: MetricsWriter):
+    stats = job_worker.stats()
+    writer.metric("jobs_running", "gauge", "Background jobs running in this process.", [({}, stats["running"])])
+    writer.metric("jobs_succeeded_total", "counter", "Background jobs that succeeded.", [({}, stats["succeeded"])])
+    writer.metric("jobs_retried_total", "counter", "Background job attempts that failed and will be retried.", [({}, stats["retried"])])
+    writer.metric("jobs_failed_total", "counter", "Background jobs that failed their last attempt.", [({}, stats["failed"])])
+
+collectors: list[Callable[[MetricsWriter], None]] = [
+    _collect_http,
+    _collect_pools,
+    _collect_engine_cache,
+    _collect_provisioner,
+    _collect_replicas,
+    _collect_password_hasher,
+    _collect_token_cache,
+    _collect_throttle,
+    _collect_user_cache,
+    _collect_token_revocations,
+    _collect_jobs,
+]
+
+def render_metrics() -> str:
+    writer = MetricsWriter()
+    for collect in collectors:
+        collect(writer)
+    return writer.render()
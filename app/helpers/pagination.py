@@ -0,0 +1,47 @@
+import base64
+import json
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app.exceptions import InvalidCursor
+
+# Keyset (seek) pagination: the cursor is the sort key of the last row of the previous page
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key), separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, types: tuple[type, ...]) -> tuple:
+    """Sort key of a cursor, whose values must have the given types (the python types of the sort columns)."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor()
+    if not isinstance(key, list) or len(key) != len(types):
+        raise InvalidCursor()
+    for value, value_type in zip(key, types):
+        if not isinstance(value, value_type) or isinstance(value, bool) and value_type is not bool:
+            raise InvalidCursor()
+    return tuple(key)
+
+# Count estimate
+class _Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, query: Select):
+        self.query = query
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element: _Explain, compiler, **kwargs) -> str:
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.query, **kwargs)}"
+
+def estimate_count(db: Session, query: Select) -> int:
+    """
+    Number of rows returned by a query, estimated by the planner on PostgreSQL (from the table statistics, without
+    running a COUNT(*)). Other databases run an exact count.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return db.scalar(select(func.count()).select_from(query.subquery()))
+    plan = db.execute(_Explain(query)).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return int(plan[0]["Plan"]["Plan Rows"])
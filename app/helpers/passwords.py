@@ -0,0 +1,171 @@
+import asyncio
+import bcrypt
+import multiprocessing
+import os
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.exceptions import ServerBusy
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # [seconds]
+
+# bcrypt functions (module level to be picklable by the process pool)
+def _hash_password(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _check_password(password: bytes, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed_password)
+
+class PasswordHasher:
+    """
+    Run the bcrypt hashing and verification outside of the request threads.
+    The work is sent to a dedicated pool ("process" or "thread", or "inline" for the threadpool of the application)
+    with a bounded number of pending operations: when the pool is saturated, a ServerBusy (503) is raised instead of queueing more work so that
+    a burst of logins cannot take every worker thread of the application.
+    """
+    def __init__(self, executor: str = "process", workers: int = 0, queue_size: int = 0, rounds: int = 12):
+        if executor not in ("process", "thread", "inline"):
+            raise ValueError(f"Unknown password hash executor: {executor}")
+        self.executor_type = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or 2 * self.workers
+        self.rounds = rounds
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        # Metrics
+        self._completed = 0
+        self._rejected = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    # Executor lifecycle
+    def _create_executor(self) -> Executor | None:
+        if self.executor_type == "process":
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        if self.executor_type == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return None
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def _replace_executor(self, broken: Executor) -> Executor:
+        """Swap a broken pool for a new one (once, whatever the number of threads that found it broken)."""
+        with self._lock:
+            if self._executor is broken or self._executor is None:
+                self._executor = self._create_executor()
+            executor = self._executor
+        # The futures of a broken pool are already failed: the pending work of the others is not cancelled
+        broken.shutdown(wait=False, cancel_futures=False)
+        return executor
+
+    # Task submission
+    def _acquire_slot(self):
+        with self._lock:
+            if self._pending >= self.queue_size:
+                self._rejected += 1
+                raise ServerBusy("Too many password operations in progress.")
+            self._pending += 1
+
+    def _release_slot(self, start_time: float):
+        latency = time.perf_counter() - start_time
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            self._latency_sum += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._latency_buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def _submit(self, fn, *args) -> Future:
+        self._acquire_slot()
+        start_time = time.perf_counter()
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died: replace the pool and retry once
+                future = self._replace_executor(executor).submit(fn, *args)
+        except BaseException:
+            self._release_slot(start_time)
+            raise
+        future.add_done_callback(lambda _: self._release_slot(start_time))
+        return future
+
+    async def _run(self, fn, *args):
+        if self.executor_type != "inline":
+            return await asyncio.wrap_future(self._submit(fn, *args))
+        # Threadpool of the application (never on the event loop)
+        self._acquire_slot()
+        start_time = time.perf_counter()
+        try:
+            return await run_in_threadpool(fn, *args)
+        finally:
+            self._release_slot(start_time)
+
+    # Public API (awaited, so that no thread of the application waits for bcrypt)
+    async def hash_async(self, password: str) -> str:
+        return (await self._run(_hash_password, password.encode("utf-8"), self.rounds)).decode("utf-8")
+
+    async def verify_async(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_check_password, plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+    async def hash_many(self, passwords: list[str], concurrency: int = 0) -> list[str]:
+        """
+        Hash a batch of passwords in parallel (bulk operations).
+        At most `concurrency` hashes (default: the number of workers) are pending at once so that the queue keeps
+        room for the interactive requests, and the hashes rejected because the queue is full are retried.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.workers)
+
+        async def hash_one(password: str) -> str:
+            async with semaphore:
+                while True:
+                    try:
+                        return await self.hash_async(password)
+                    except ServerBusy:
+                        await asyncio.sleep(0.05)
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executor": self.executor_type,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "latency_sum": self._latency_sum,  # [seconds]
+                "latency_max": self._latency_max,  # [seconds]
+                "latency_buckets": dict(zip(LATENCY_BUCKETS + (float("inf"),), self._latency_buckets)),
+            }
+
+password_hasher = PasswordHasher(
+    executor=settings.password_hash_executor,
+    workers=settings.password_hash_workers,
+    queue_size=settings.password_hash_queue_size,
+    rounds=settings.password_hash_rounds,
+)
@@ -0,0 +1,103 @@
+import logging
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Parameters lists of variable length (e.g. "IN (?, ?, ?)") are collapsed to get the shape of a statement
+_PARAMETER = r"(?:\?|%s|%\([^)]*\)s|\$\d+|:\w+)"
+_PARAMETERS_LIST = re.compile(rf"\(\s*{_PARAMETER}(?:\s*,\s*{_PARAMETER})+\s*\)")
+_WHITESPACES = re.compile(r"\s+")
+
+def statement_shape(statement: str) -> str:
+    return _PARAMETERS_LIST.sub("(...)", _WHITESPACES.sub(" ", statement).strip())
+
+@dataclass
+class QueryProfile:
+    """Queries run while handling one request."""
+    queries: int = 0
+    duration: float = 0.0 # [seconds]
+    statements: dict[str, list] = field(default_factory=dict) # shape -> [count, duration]
+
+    def record(self, statement: str, duration: float):
+        self.queries += 1
+        self.duration += duration
+        shape = statement_shape(statement)
+        stats = self.statements.get(shape)
+        if stats is None:
+            self.statements[shape] = [1, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        """Statements run at least `threshold` times (most likely N+1 queries)."""
+        return {shape: count for shape, (count, _) in self.statements.items() if count >= threshold}
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.duration * 1000:.2f};desc="{self.queries} queries"'
+
+_current_profile: ContextVar[QueryProfile | None] = ContextVar("sql_profile", default=None)
+
+def current_profile() -> QueryProfile | None:
+    return _current_profile.get()
+
+# Engine events (registered on the Engine class: all the sync engines and the sync side of the async ones)
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    start_times = conn.info.get("query_start_times")
+    if profile is None or not start_times:
+        return
+    profile.record(statement, time.perf_counter() - start_times.pop())
+
+def install_profiler():
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+class SQLProfilerMiddleware:
+    """
+    Pure ASGI middleware profiling the SQL queries of each request: the totals are sent in a Server-Timing header
+    (and added to the request log by `log_requests`), and a warning is logged when a statement runs at least
+    `n_plus_one_threshold` times.
+    The sessions given by get_global_db/get_event_db (and their async versions) all run in the context of the
+    request, so their queries are recorded without having to pass the profile around.
+    """
+    def __init__(self, app, n_plus_one_threshold: int = 5):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+        install_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile = QueryProfile()
+        token = _current_profile.set(profile)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and profile.queries:
+                message["headers"] = [*message.get("headers", []), (b"server-timing", profile.server_timing().encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_profile.reset(token)
+            repeated = profile.repeated(self.n_plus_one_threshold)
+            if repeated:
+                logger.warning({
+                    "event": "n_plus_one",
+                    "method": scope["method"],
+                    "route": getattr(scope.get("route"), "path", scope.get("path")),
+                    "queries": profile.queries,
+                    "db_time": profile.duration, # in seconds
+                    "repeated": repeated,
+                })
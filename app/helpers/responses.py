@@ -0,0 +1,13 @@
+from pydantic_core import to_json
+from fastapi import Response
+
+class ModelResponse(Response):
+    """
+    JSON response of a Pydantic model (or of lists and dicts of models), encoded by pydantic-core in one pass.
+    For the trusted outputs of the routes: FastAPI sends a Response as is, so the model is not dumped and validated
+    again against the response model of the route (which is still used for the OpenAPI schema).
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return to_json(content)
@@ -0,0 +1,107 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Request
+
+from app.core.config import settings
+from app.exceptions import TooManyRequests
+
+class _Shard:
+    __slots__ = ("lock", "buckets")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: OrderedDict[str, list[float]] = OrderedDict() # key -> [tokens, last refill time]
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by string (client IP, email, ...): each key may spend `burst` requests at once, refilled at
+    `rate` requests per second.
+    The keys are spread over `shards` LRU dicts with their own lock, and at most `capacity` keys are kept: the least
+    recently used buckets are evicted first (an evicted key starts again with a full bucket).
+    """
+    def __init__(self, rate: float, burst: float, capacity: int, shards: int = 16):
+        self.rate = rate
+        self.burst = burst
+        self.shard_capacity = max(1, capacity // shards)
+        self._shards = [_Shard() for _ in range(shards)]
+
+        # Metrics
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Spend `cost` tokens of the bucket of `key`: 0 when allowed, otherwise the seconds to wait before retrying."""
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = time.monotonic()
+        with shard.lock:
+            bucket = shard.buckets.get(key)
+            if bucket is None:
+                bucket = shard.buckets[key] = [self.burst, now]
+                if len(shard.buckets) > self.shard_capacity:
+                    shard.buckets.popitem(last=False)
+                    self.evictions += 1
+            else:
+                shard.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                return 0.0
+            self.rejected += 1
+            return (cost - bucket[0]) / self.rate
+
+    def size(self) -> int:
+        return sum(len(shard.buckets) for shard in self._shards)
+
+    def stats(self) -> dict:
+        return {"size": self.size(), "allowed": self.allowed, "rejected": self.rejected, "evictions": self.evictions}
+
+def client_ip(request: Request) -> str:
+    if settings.throttle_trust_forwarded_for:
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+class AuthThrottle:
+    """
+    Throttle of the routes running bcrypt (`/users/login` and `/users/register`), checked before any hashing:
+    the requests are limited by client IP and by (client IP, email), so that a credential-stuffing burst is answered
+    with 429 Too Many Requests instead of using all the CPU. The email is throttled per client IP so that the
+    attempts of one IP on an account never lock its owner out from another IP.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        capacity, shards = settings.throttle_capacity, settings.throttle_shards
+        self.limiters = {
+            "login_ip": TokenBucketLimiter(settings.login_ip_rate, settings.login_ip_burst, capacity, shards),
+            "login_ip_email": TokenBucketLimiter(settings.login_email_rate, settings.login_email_burst, capacity, shards),
+            "register_ip": TokenBucketLimiter(settings.register_ip_rate, settings.register_ip_burst, capacity, shards),
+        }
+
+    def _check(self, *checks: tuple[str, str]):
+        if not settings.throttle_enabled:
+            return
+        # In order: the requests rejected by IP do not spend the tokens of their email
+        for name, key in checks:
+            retry_after = self.limiters[name].acquire(key)
+            if retry_after > 0:
+                raise TooManyRequests(math.ceil(retry_after))
+
+    def check_login(self, request: Request, email: str):
+        ip = client_ip(request)
+        self._check(("login_ip", ip), ("login_ip_email", f"{ip} {email.lower()}"))
+
+    def check_register(self, request: Request):
+        self._check(("register_ip", client_ip(request)))
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+auth_throttle = AuthThrottle()
@@ -0,0 +1,40 @@
+import hashlib
+import time
+from dataclasses import dataclass
+
+from app.helpers.cache import TTLCache
+from app.modules.user.models import UserMailModel
+
+@dataclass(frozen=True, slots=True)
+class VerifiedToken:
+    user: UserMailModel
+    scopes: frozenset[str]
+    expires_at: float | None # Unix timestamp of the "exp" claim
+    jti: str | None = None # Identifier of the token (revocation of a single token)
+    issued_at: float | None = None # Unix timestamp of the "iat" claim (revocation of the tokens of a user)
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache of the tokens that have already been decoded and verified.
+    Entries are keyed by a digest of the token (the token itself is never stored) and expire with the "exp" claim
+    of the token, so that expiry is enforced like jwt.decode does.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._cache: TTLCache[bytes, VerifiedToken] = TTLCache(capacity)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, token: str) -> VerifiedToken | None:
+        return self._cache.get(self._key(token))
+
+    def put(self, token: str, verified_token: VerifiedToken):
+        self._cache.put(self._key(token), verified_token, ttl=verified_token.expires_at - time.time())
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
@@ -0,0 +1,132 @@
+import io
+from typing import AsyncIterator
+from PIL import Image
+from fastapi import Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.exceptions import InvalidImage
+
+MULTIPART_OVERHEAD = 64 * 1024 # [bytes] Allowed size of the multipart envelope (boundaries, headers, other fields)
+SNIFF_SIZE = 64 * 1024 # [bytes] Maximum size read to identify an image
+IMAGE_SIGNATURES = {
+    "PNG": (b"\x89PNG\r\n\x1a\n",),
+    "JPEG": (b"\xff\xd8\xff",),
+}
+
+# Request body streaming
+async def _iter_multipart_field(request: Request, boundary: bytes, field_name: str, max_body_size: int) -> AsyncIterator[bytes]:
+    state = {"header_field": b"", "header_value": b"", "in_field": False, "found": False}
+    pending = []
+
+    def on_part_begin():
+        state["in_field"] = False
+
+    def on_header_field(data: bytes, start: int, end: int):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        if state["header_field"].lower() == b"content-disposition":
+            _, options = parse_options_header(state["header_value"])
+            state["in_field"] = options.get(b"name") == field_name.encode("utf-8") and b"filename" in options
+            state["found"] = state["found"] or state["in_field"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if state["in_field"]:
+            pending.append(data[start:end])
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": on_part_data,
+    })
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_body_size:
+            raise InvalidImage("Image file too large")
+        try:
+            parser.write(chunk)
+        except MultipartParseError:
+            raise InvalidImage("Malformed multipart body")
+        while pending:
+            yield pending.pop(0)
+    parser.finalize()
+    if not state["found"]:
+        raise InvalidImage(f"Missing '{field_name}' file")
+
+async def iter_upload(request: Request, field_name: str, max_size: int) -> AsyncIterator[bytes]:
+    """
+    Yield the bytes of an uploaded file as they arrive, without spooling the request body.
+    The file is either the `field_name` part of a multipart/form-data body or the raw body of the request.
+    InvalidImage is raised as soon as more than `max_size` bytes are received.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise InvalidImage("Image file too large")
+
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type == b"multipart/form-data":
+        if not options.get(b"boundary"):
+            raise InvalidImage("Missing multipart boundary")
+        chunks = _iter_multipart_field(request, options[b"boundary"], field_name, max_size + MULTIPART_OVERHEAD)
+    else:
+        chunks = request.stream()
+
+    received = 0
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        received += len(chunk)
+        if received > max_size:
+            raise InvalidImage("Image file too large")
+        yield chunk
+    if not received:
+        raise InvalidImage("Empty image file")
+
+# Image validation
+def _identify_image(head: bytes) -> Image.Image | None:
+    try:
+        return Image.open(io.BytesIO(head))
+    except Image.DecompressionBombError:
+        raise InvalidImage("Image dimensions too large")
+    except Exception:
+        return None # Not enough data yet (or not an image)
+
+async def sniff_image(chunks: AsyncIterator[bytes], allowed_formats: tuple[str, ...] = ("PNG", "JPEG")) -> tuple[str, AsyncIterator[bytes]]:
+    """
+    Identify the format of a streamed image from its first bytes: the magic bytes are checked first, then the
+    headers are parsed with Pillow (only the headers, the pixels are not decoded).
+    Return the Pillow format and an iterator yielding the whole stream again (the sniffed bytes included).
+    """
+    iterator = aiter(chunks)
+    consumed = []
+    head = b""
+    image = None
+    while image is None and len(head) < SNIFF_SIZE:
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            break
+        consumed.append(chunk)
+        head += chunk
+        signatures = [signature for image_format in allowed_formats for signature in IMAGE_SIGNATURES.get(image_format, ())]
+        if not any(signature.startswith(head[:len(signature)]) for signature in signatures):
+            raise InvalidImage(f"Only {', '.join(allowed_formats)} files are allowed")
+        image = _identify_image(head)
+    if image is None or image.format not in allowed_formats:
+        raise InvalidImage("Invalid image file")
+
+    async def replay() -> AsyncIterator[bytes]:
+        for chunk in consumed:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+    return image.format, replay()
@@ -1,30 +1,56 @@
 import logging
 import time
-from logging.handlers import RotatingFileHandler
-from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import RedirectResponse, Response
 
-from app.db.database import init_global_db, close_all_db, init_minio_db, load_roles_from_csv
+from app.db.database import init_global_db, close_all_db, close_all_async_db, init_event_db_provisioning, close_event_db_provisioning, init_minio_db, close_minio_db, load_roles_from_csv, load_role_registry
 from app.modules.user.router import router as user_router
+from app.modules.user.router_async import router as user_async_router
+from app.modules.user.router_bulk import router as user_bulk_router
 from app.core.config import settings
-from app.helpers.logs import StructuredLogger
+from app.helpers.logs import StructuredLogger, LoggingPipeline, filter_headers, should_log_request
+from app.helpers.passwords import password_hasher
+from app.helpers.images import image_processor
+from app.helpers.profiler import SQLProfilerMiddleware, current_profile
+from app.modules.user.revocation import token_revocations
+from app.db.jobs import job_worker
+from app.db.engines import event_engines, event_async_engines
+from app.helpers.metrics import MetricsMiddleware, MetricsWriter, CONTENT_TYPE, collectors, render_metrics
 
 # Logging configuration
 logging.setLoggerClass(StructuredLogger)
 logger = logging.getLogger(__name__)
-handler = RotatingFileHandler(settings.log_file, maxBytes=settings.log_max_size, backupCount=settings.log_backup_count)
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+app_logger = logging.getLogger("app") # Parent of the loggers of all the modules
+app_logger.setLevel(logging.INFO)
+logging_pipeline = LoggingPipeline(app_logger, settings.log_file, settings.log_max_size, settings.log_backup_count,
+                                   settings.log_queue_size, settings.log_batch_size)
 
 # Lifespan events
 async def lifespan(app: FastAPI):
+    logging_pipeline.start(clear=True)
     init_global_db()
+    init_event_db_provisioning()
     init_minio_db()
-    with open("app.log", "w"):  # Clear the log file
-        pass
     load_roles_from_csv(settings.roles_csv_path)
+    load_role_registry()
+    token_revocations.start()
+    event_engines.start()
+    event_async_engines.start()
+    password_hasher.start()
+    image_processor.start()
+    job_worker.start()
     yield
+    job_worker.shutdown()
+    image_processor.shutdown()
+    password_hasher.shutdown()
+    event_async_engines.shutdown()
+    event_engines.shutdown()
+    token_revocations.shutdown()
+    close_event_db_provisioning()
+    await close_all_async_db()
     close_all_db()
+    close_minio_db()
+    logging_pipeline.stop()
 
 # FastAPI application
 app = FastAPI(lifespan=lifespan,
@@ -40,22 +66,29 @@ async def log_requests(request: Request, call_next):
     start_time = time.perf_counter()
     response = await call_next(request)
     process_time = time.perf_counter() - start_time
-    background_tasks = BackgroundTasks()
-    background_tasks.add_task(
-        logger.info, 
-        {
+    if should_log_request(response.status_code, process_time):
+        # Only queued here: the record is serialized and written by the thread of the logging pipeline
+        record = {
             "event": "request",
-            "method": request.method, 
-            "url": str(request.url), 
-            "headers": dict(request.headers), 
-            "client": request.client.host, 
+            "method": request.method,
+            "url": str(request.url),
+            "headers": filter_headers(request.headers, settings.log_headers, settings.log_redacted_headers),
+            "client": request.client.host if request.client else None,
             "response_code": response.status_code,
             "process_time": process_time # in seconds
         }
-    )
-    response.background = background_tasks
+        profile = current_profile()
+        if profile is not None:
+            record["sql_queries"] = profile.queries
+            record["sql_time"] = profile.duration # in seconds
+        logger.info(record)
     return response
 
+if settings.sql_profiler_enabled:
+    app.add_middleware(SQLProfilerMiddleware, n_plus_one_threshold=settings.sql_profiler_n_plus_one_threshold)
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware) # Outermost middleware: the logging middleware is timed too
+
 ##########
 # ROUTES #
 ##########
@@ -64,7 +97,22 @@ def redirect_to_website():
     """"Redirect to the 'settings.website_url'."""
     return RedirectResponse(url=settings.website_url)
 
+def _collect_logging(writer: MetricsWriter):
+    stats = logging_pipeline.stats()
+    writer.metric("log_queue_depth", "gauge", "Log records waiting to be written.", [({}, stats["queue_depth"])])
+    writer.metric("log_dropped_total", "counter", "Log records dropped because the queue was full.", [({}, stats["dropped"])])
+
+collectors.append(_collect_logging)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Metrics in the Prometheus text format."""
+    if not settings.metrics_enabled:
+        return Response(status_code=404)
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
 ###################
 # INCLUDE ROUTERS #
 ###################
-app.include_router(user_router)
+app.include_router(user_async_router if settings.database_async else user_router)
+app.include_router(user_bulk_router)
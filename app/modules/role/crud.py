@@ -1,45 +1,34 @@
 from sqlalchemy.orm import Session
 
-from app.modules.role.schemas import RoleSchema
 from app.modules.role.models import RoleBaseModel
+from app.modules.role.registry import role_registry
 from app.exceptions import InvalidRole
 
 # Get the default roles
 def get_default_global_role(db: Session) -> RoleBaseModel:
-    db_role = db.query(RoleSchema).filter(RoleSchema.default_global).first()
-    return RoleBaseModel(**db_role.__dict__)
+    return role_registry.snapshot(db).default_global
 
 def get_default_event_role(db: Session) -> RoleBaseModel:
-    db_role = db.query(RoleSchema).filter(RoleSchema.default_event).first()
-    return RoleBaseModel(**db_role.__dict__)
+    return role_registry.snapshot(db).default_event
 
 def get_default_admin_role(db: Session) -> RoleBaseModel:
-    db_role = db.query(RoleSchema).filter(RoleSchema.default_admin).first()
-    return RoleBaseModel(**db_role.__dict__)
+    return role_registry.snapshot(db).default_admin
 
 # Get list of roles
 def get_global_role_by_name(db: Session, role_name: str) -> RoleBaseModel:
-    db_role = db.query(RoleSchema).filter(RoleSchema.name == role_name).first()
-    if not db_role:
+    role = role_registry.snapshot(db).roles.get(role_name)
+    if not role:
         raise InvalidRole()
-    return RoleBaseModel(**db_role.__dict__)
+    return role
 
 # Resolve the role hierarchy for JWT token creation
 def get_user_global_roles_jwt_format(db: Session, user_global_role: str) -> list[str]:
     """
     Get the list of roles in the JWT format that the user has by resolving the role hierarchy.
-    Return the list of the roles in format "globla:<role_name>" with all the global role that the user has.
+    Return the list of the roles in format "global:<role_name>" with all the global role that the user has.
+    The hierarchy is resolved once by the role registry, so no query is done here once the registry is loaded.
     """
-    # Get the user global role
-    db_role = db.query(RoleSchema).filter(RoleSchema.name == user_global_role).first()
-    user_roles = [f"global:{db_role.name}"]
-    
-    # Get all the childs and subchilds of the user global role
-    roles_stack = [db_role]
-    while roles_stack:
-        current_role = roles_stack.pop()
-        children_roles = db.query(RoleSchema).filter(RoleSchema.parent_id == current_role.id, RoleSchema.categorie == "global").all()
-        if children_roles:
-            roles_stack.extend(children_roles)
-            user_roles.extend([f"global:{child_role.name}" for child_role in children_roles])
-    return user_roles
\ No newline at end of file
+    user_roles = role_registry.snapshot(db).scopes.get(user_global_role)
+    if user_roles is None:
+        raise InvalidRole()
+    return list(user_roles)
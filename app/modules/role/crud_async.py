@@ -0,0 +1,35 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.modules.role.models import RoleBaseModel
+from app.modules.role.registry import role_registry, RoleSnapshot
+from app.exceptions import InvalidRole
+
+# Async versions of app.modules.role.crud (see settings.database_async)
+async def _get_snapshot(db: AsyncSession) -> RoleSnapshot:
+    if role_registry.is_stale:
+        return await db.run_sync(role_registry.snapshot)
+    return role_registry.current
+
+# Get the default roles
+async def get_default_global_role(db: AsyncSession) -> RoleBaseModel:
+    return (await _get_snapshot(db)).default_global
+
+async def get_default_event_role(db: AsyncSession) -> RoleBaseModel:
+    return (await _get_snapshot(db)).default_event
+
+async def get_default_admin_role(db: AsyncSession) -> RoleBaseModel:
+    return (await _get_snapshot(db)).default_admin
+
+# Get list of roles
+async def get_global_role_by_name(db: AsyncSession, role_name: str) -> RoleBaseModel:
+    role = (await _get_snapshot(db)).roles.get(role_name)
+    if not role:
+        raise InvalidRole()
+    return role
+
+# Resolve the role hierarchy for JWT token creation
+async def get_user_global_roles_jwt_format(db: AsyncSession, user_global_role: str) -> list[str]:
+    user_roles = (await _get_snapshot(db)).scopes.get(user_global_role)
+    if user_roles is None:
+        raise InvalidRole()
+    return list(user_roles)
@@ -0,0 +1,111 @@
+import threading
+from dataclasses import dataclass, field
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.modules.role.schemas import RoleSchema
+from app.modules.role.models import RoleBaseModel
+
+@dataclass(frozen=True)
+class RoleSnapshot:
+    """
+    Immutable view of the roles table at a given time.
+    The JWT scopes of each role (the role itself and all its global childs and subchilds) are resolved once when the snapshot is built.
+    """
+    roles: dict[str, RoleBaseModel] = field(default_factory=dict)
+    scopes: dict[str, tuple[str, ...]] = field(default_factory=dict)
+    default_global: RoleBaseModel | None = None
+    default_event: RoleBaseModel | None = None
+    default_admin: RoleBaseModel | None = None
+
+def _build_snapshot(db_roles: list[RoleSchema]) -> RoleSnapshot:
+    roles = {}
+    defaults = {}
+    global_children: dict[int, list[RoleSchema]] = {}
+    for db_role in sorted(db_roles, key=lambda role: role.id):
+        role = RoleBaseModel(name=db_role.name, description=db_role.description)
+        roles[db_role.name] = role
+        for default in ("default_global", "default_event", "default_admin"):
+            if getattr(db_role, default) and default not in defaults:
+                defaults[default] = role
+        if db_role.categorie == "global" and db_role.parent_id is not None:
+            global_children.setdefault(int(db_role.parent_id), []).append(db_role)
+
+    # Resolve the hierarchy of each role (same walk as the one done previously with one query per node)
+    scopes = {}
+    for db_role in db_roles:
+        role_scopes = [f"global:{db_role.name}"]
+        roles_stack = [db_role]
+        visited = {db_role.id}
+        while roles_stack:
+            current_role = roles_stack.pop()
+            children_roles = [child for child in global_children.get(current_role.id, []) if child.id not in visited]
+            visited.update(child.id for child in children_roles)
+            roles_stack.extend(children_roles)
+            role_scopes.extend(f"global:{child_role.name}" for child_role in children_roles)
+        scopes[db_role.name] = tuple(role_scopes)
+    return RoleSnapshot(roles=roles, scopes=scopes, **defaults)
+
+class RoleRegistry:
+    """
+    In-memory registry of the roles.
+    The roles are loaded once from the database (at startup) and served from memory afterwards.
+    Any committed change to the roles table marks the registry as stale so that it is rebuilt on the next lookup.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: RoleSnapshot | None = None
+        self._version = 0
+        self._loaded_version = -1
+
+    @property
+    def current(self) -> RoleSnapshot | None:
+        return self._snapshot
+
+    @property
+    def is_stale(self) -> bool:
+        return self._snapshot is None or self._loaded_version != self._version
+
+    def _load(self, db: Session) -> RoleSnapshot:
+        version = self._version
+        snapshot = _build_snapshot(db.query(RoleSchema).all())
+        self._snapshot = snapshot
+        self._loaded_version = version
+        return snapshot
+
+    def load(self, db: Session) -> RoleSnapshot:
+        with self._lock:
+            return self._load(db)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+
+    def snapshot(self, db: Session) -> RoleSnapshot:
+        snapshot = self._snapshot
+        if self.is_stale:
+            with self._lock:
+                snapshot = self._load(db) if self.is_stale else self._snapshot
+        return snapshot
+
+role_registry = RoleRegistry()
+
+# Keep the registry in sync with the roles table
+@event.listens_for(RoleSchema, "after_insert")
+@event.listens_for(RoleSchema, "after_update")
+@event.listens_for(RoleSchema, "after_delete")
+def _flag_roles_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["roles_changed"] = True
+    else:
+        role_registry.invalidate()
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("roles_changed", False):
+        role_registry.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("roles_changed", None)
@@ -0,0 +1,210 @@
+import csv
+import io
+import json
+from collections import deque
+from typing import AsyncIterator, Iterator
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db.base import GlobalSessionLocal
+from app.helpers.passwords import password_hasher
+from app.modules.user.schemas import UserSchema
+from app.modules.user.models import UserImportModel, UserImportErrorModel, UserImportReportModel
+import app.modules.role.crud as role_crud
+
+EXPORT_COLUMNS = ("first_name", "last_name", "email", "role", "profile_picture_key")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json")
+
+# Import parsing
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+    """Yield the lines of the request body as they arrive (one record per line)."""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+class _LineFeed:
+    """Lines given to a csv.reader as they arrive (it is only advanced once a whole record has been fed)."""
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+async def _iter_records(request: Request) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """Yield (line number, record, parsing error) for each non empty record of a CSV (with header) or NDJSON body."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    is_ndjson = content_type in NDJSON_CONTENT_TYPES
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    header = None
+    in_quotes = False # Quoted CSV field continued on the next line
+    record_line = 0
+    line_number = 0
+    async for line in _iter_lines(request):
+        line_number += 1
+        if is_ndjson:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, None, "Invalid JSON"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Expected a JSON object"
+                continue
+            yield line_number, record, None
+            continue
+        if not in_quotes:
+            if not line.strip():
+                continue
+            record_line = line_number
+        feed.lines.append(line + "\n")
+        in_quotes ^= line.count('"') % 2 == 1
+        if in_quotes:
+            continue
+        values = next(reader)
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            continue
+        if len(values) != len(header):
+            yield record_line, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield record_line, {name: value for name, value in zip(header, values) if value != ""}, None
+    if in_quotes:
+        yield record_line, None, "Unterminated quoted field"
+
+# Import batches
+def _insert_statement(db: Session):
+    # Rows conflicting with a user created meanwhile are skipped (and reported) instead of failing the whole batch
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(UserSchema).on_conflict_do_nothing(index_elements=["email"]).returning(UserSchema.email)
+    if dialect == "sqlite":
+        return sqlite.insert(UserSchema).on_conflict_do_nothing(index_elements=["email"]).returning(UserSchema.email)
+    return insert(UserSchema).returning(UserSchema.email)
+
+def _existing_emails(db: Session, emails: list[str]) -> set[str]:
+    return set(db.scalars(select(UserSchema.email).where(UserSchema.email.in_(emails))))
+
+def _check_roles(db: Session, rows: list[tuple[int, UserImportModel]], report: UserImportReportModel) -> list[tuple[int, UserImportModel, str]]:
+    default_role = role_crud.get_default_global_role(db).name
+    checked = []
+    for line, user in rows:
+        role = user.role or default_role
+        if user.role:
+            try:
+                role = role_crud.get_global_role_by_name(db, user.role).name
+            except HTTPException as e:
+                _add_error(report, line, user.email, e.detail)
+                continue
+        checked.append((line, user, role))
+    return checked
+
+def _insert_users(db: Session, rows: list[tuple[int, UserImportModel, str]], hashed_passwords: list[str], report: UserImportReportModel):
+    values = [
+        {"first_name": user.first_name, "last_name": user.last_name, "email": user.email, "hashed_password": hashed_password, "role": role, "profile_picture_key": None}
+        for (_, user, role), hashed_password in zip(rows, hashed_passwords)
+    ]
+    # Multi-row INSERT ... VALUES batches (SQLAlchemy "insertmanyvalues")
+    inserted = set(db.scalars(_insert_statement(db), values))
+    db.commit()
+    for line, user, _ in rows:
+        if user.email in inserted:
+            report.created += 1
+        else:
+            _add_error(report, line, user.email, "A user with this email already exists.")
+
+def _add_error(report: UserImportReportModel, line: int, email: str | None, error: str):
+    report.failed += 1
+    if len(report.errors) < settings.user_import_max_errors:
+        report.errors.append(UserImportErrorModel(line=line, email=email, error=error))
+
+async def _import_batch(db: Session, batch: list[tuple[int, UserImportModel]], report: UserImportReportModel):
+    existing = await run_in_threadpool(_existing_emails, db, [user.email for _, user in batch])
+    rows = []
+    for line, user in batch:
+        if user.email in existing:
+            _add_error(report, line, user.email, "A user with this email already exists.")
+        else:
+            rows.append((line, user))
+    rows = await run_in_threadpool(_check_roles, db, rows, report)
+    if not rows:
+        return
+    hashed_passwords = await password_hasher.hash_many([user.password for _, user, _ in rows])
+    await run_in_threadpool(_insert_users, db, rows, hashed_passwords, report)
+
+async def import_users(db: Session, request: Request) -> UserImportReportModel:
+    """
+    Create the users of a CSV (with a header line) or NDJSON body, streamed and processed by batches:
+    the emails of each batch are checked with one query, the passwords are hashed in parallel and the rows are
+    inserted with multi-row INSERT statements. Invalid rows are reported with their line number.
+    """
+    report = UserImportReportModel()
+    batch = []
+    seen_emails = set()
+    async for line, record, error in _iter_records(request):
+        if error:
+            _add_error(report, line, None, error)
+            continue
+        try:
+            user = UserImportModel(**record)
+        except ValidationError as e:
+            email = record.get("email")
+            _add_error(report, line, email if isinstance(email, str) else None, "; ".join(f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in e.errors()))
+            continue
+        if user.email in seen_emails:
+            _add_error(report, line, user.email, "Duplicated email in the imported file.")
+            continue
+        seen_emails.add(user.email)
+        batch.append((line, user))
+        if len(batch) >= settings.user_import_batch_size:
+            await _import_batch(db, batch, report)
+            batch = []
+    if batch:
+        await _import_batch(db, batch, report)
+    report.errors.sort(key=lambda error: error.line)
+    return report
+
+# Export
+def _export_rows() -> Iterator[tuple]:
+    # Own session: the one of the dependency is closed before the response body is streamed
+    db = GlobalSessionLocal()
+    try:
+        columns = [getattr(UserSchema, column) for column in EXPORT_COLUMNS]
+        statement = select(*columns).order_by(UserSchema.id).execution_options(yield_per=settings.user_export_batch_size) # Server-side cursor
+        for partition in db.execute(statement).partitions():
+            yield partition
+    finally:
+        db.close()
+
+def export_users_csv() -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for partition in _export_rows():
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def export_users_ndjson() -> Iterator[str]:
+    for partition in _export_rows():
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in partition)
@@ -0,0 +1,89 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from fastapi import Response
+
+from app.core.config import settings
+from app.db.replicas import replica_router
+from app.helpers.cache import TTLCache
+from app.modules.user.schemas import UserSchema
+from app.modules.user.models import UserBaseModel
+
+@dataclass(frozen=True, slots=True)
+class CachedUser:
+    user: UserBaseModel
+    body: bytes # Serialized JSON of the user
+    etag: str # Strong ETag of the body
+
+    @classmethod
+    def from_user(cls, user: UserBaseModel) -> "CachedUser":
+        body = user.model_dump_json().encode("utf-8")
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        return cls(user=user, body=body, etag=etag)
+
+    def response(self, if_none_match: str | None) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if if_none_match and (if_none_match.strip() == "*" or self.etag in [tag.strip() for tag in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+class UserReadCache:
+    """
+    Bounded LRU cache of the users read by email (`/users/me`).
+    The entries are invalidated when a change to a user is committed (see the session events below) and expire
+    after `ttl` seconds, which bounds the staleness when several worker processes serve the application.
+    A missing user is loaded once for all the concurrent requests, and the value of a load during which the user
+    was invalidated is not stored, so that a concurrent write is never hidden.
+    """
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._cache: TTLCache[str, CachedUser] = TTLCache(capacity, ttl)
+
+    def get_or_load(self, email: str, loader: Callable[[], UserBaseModel]) -> CachedUser:
+        return self._cache.get_or_load(email, lambda: CachedUser.from_user(loader()))
+
+    async def aget_or_load(self, email: str, loader: Callable[[], Awaitable[UserBaseModel]]) -> CachedUser:
+        async def load() -> CachedUser:
+            return CachedUser.from_user(await loader())
+        return await self._cache.aget_or_load(email, load)
+
+    def invalidate(self, *emails: str):
+        self._cache.invalidate(*emails)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+user_cache = UserReadCache(settings.user_cache_capacity, settings.user_cache_ttl)
+
+# Write-through invalidation: the emails of the users changed in a session are invalidated when it commits
+# (and read from the primary for a while, see app.db.replicas)
+def mark_users_changed(session: Session, *emails: str):
+    """Invalidate the emails when the session commits (for the changes made without the unit of work, e.g. an UPDATE)."""
+    session.info.setdefault("changed_user_emails", set()).update(emails)
+
+def _mark_changed(mapper, connection, target: UserSchema):
+    session = Session.object_session(target)
+    if session is None:
+        return
+    previous_emails = [email for email in inspect(target).attrs.email.history.deleted if email]
+    mark_users_changed(session, target.email, *previous_emails)
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(UserSchema, _event_name, _mark_changed)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session: Session):
+    emails = session.info.pop("changed_user_emails", None)
+    if emails:
+        user_cache.invalidate(*emails)
+        replica_router.record_writes(emails)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session: Session):
+    session.info.pop("changed_user_emails", None)
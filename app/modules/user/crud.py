@@ -1,39 +1,50 @@
-import bcrypt
+import io
 import jwt
 import re
-import io
+import secrets
+import time
 from minio.error import S3Error
-from datetime import datetime, timedelta, timezone
-from minio import Minio
+from datetime import timedelta
+from sqlalchemy import Select, func, literal_column, or_, select, tuple_, update
 from sqlalchemy.orm import Session
-from fastapi import UploadFile
-from fastapi.responses import StreamingResponse
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse
+from starlette.datastructures import Headers
 
 from app.exceptions import UserAlreadyExists, UserNotFound, InvalidPassword, RoleNotAssignable, InvalidImage, ImageNotFound
 from app.core.config import settings
-from app.modules.user.schemas import UserSchema
-from app.modules.user.models import UserBaseModel, UserRegisterModel, UserLoginModel, UserNamesModel, UserMailModel, UserUpdatePasswordModel, UserUpdateRoleModel
+from app.db.base import GlobalSessionLocal
+from app.db.storage import ObjectStorage, storage, remove_objects
+from app.helpers.passwords import password_hasher
+from app.helpers.uploads import iter_upload, sniff_image
+from app.helpers.images import VARIANT_FORMATS, image_processor, select_variant_size, variant_key, variant_keys
+from app.helpers.downloads import PresignedUrlCache, object_response
+from app.helpers.pagination import encode_cursor, decode_cursor, estimate_count
+from app.modules.user.schemas import UserSchema, SEARCH_DOCUMENT
+from app.modules.user.cache import user_cache, mark_users_changed
+from app.helpers.token_cache import VerifiedToken
+from app.modules.user.revocation import revoke_user_tokens, revoke_token
+from app.db.replicas import prefer_primary
+from app.db.jobs import enqueue, job_handler
+from app.modules.user.models import UserPageModel, UserBaseModel, UserRegisterModel, UserLoginModel, UserNamesModel, UserMailModel, UserUpdatePasswordModel, UserUpdateRoleModel
 import app.modules.role.crud as role_crud
 
-# Password hashing and verification
-def _get_hashed_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-
-def _verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+presigned_urls = PresignedUrlCache(settings.minio_presigned_url_cache_capacity, settings.minio_presigned_url_margin)
 
 # User global roles management
 def _is_last_admin(db: Session, user: UserBaseModel) -> bool:
-    if user.role == role_crud.get_default_admin_role(db).name:
-        if db.query(UserSchema).filter(UserSchema.role == role_crud.get_default_admin_role(db).name).count() == 1:
+    admin_role = role_crud.get_default_admin_role(db).name
+    if user.role == admin_role:
+        if db.query(UserSchema).filter(UserSchema.role == admin_role).count() == 1:
             return True
     return False
 
 # JWT token creation
 def create_access_token(data: dict, expires_delta: timedelta) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + expires_delta
-    to_encode.update({"exp": expire})
+    issued_at = time.time() # Sub-second precision: compared to the "tokens valid after" timestamp of the user
+    to_encode.update({"exp": int(issued_at + expires_delta.total_seconds()), "iat": issued_at, "jti": secrets.token_urlsafe(16)})
     return jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
 
 # User getters and setters
@@ -46,12 +57,131 @@ def get_and_check_user_by_email(db: Session, email: str) -> UserSchema:
         raise UserNotFound()
     return db_user
 
-def get_user_profile_picture(db: Session, minio_db: Minio, current_user: UserMailModel) -> UploadFile:
+def locked_user_query(email: str) -> Select:
+    """The user row locked until the end of the transaction (refreshed if the session has already loaded it)."""
+    return select(UserSchema).where(UserSchema.email == email).with_for_update().execution_options(populate_existing=True)
+
+def get_user_me(db: Session, email: str, if_none_match: str | None) -> Response:
+    """The user is served from the read cache, with a strong ETag (304 Not Modified when the client has it)."""
+    def load_user() -> UserBaseModel:
+        prefer_primary(db, email)
+        return UserBaseModel.from_schema(get_and_check_user_by_email(db, email))
+    cached_user = user_cache.get_or_load(email, load_user)
+    return cached_user.response(if_none_match)
+
+# User listing (keyset pagination on the order of the ix_users_keyset index)
+LIST_SORT_KEY = (UserSchema.last_name, UserSchema.first_name, UserSchema.id)
+LIST_SORT_KEY_TYPES = tuple(column.type.python_type for column in LIST_SORT_KEY) # (str, str, int)
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def build_list_users_query(search: str | None, match: str) -> Select:
+    """
+    Users matching the search: "prefix" matches the beginning of the first name, last name or email and "contains"
+    matches anywhere in them (backed by the prefix and trigram indexes of app.modules.user.schemas on PostgreSQL).
+    """
+    query = select(UserSchema)
+    if search:
+        term = _escape_like(search.lower())
+        if match == "contains":
+            query = query.where(literal_column(SEARCH_DOCUMENT).like(f"%{term}%", escape="\\"))
+        else:
+            columns = (UserSchema.first_name, UserSchema.last_name, UserSchema.email)
+            query = query.where(or_(*(func.lower(column).like(f"{term}%", escape="\\") for column in columns)))
+    return query
+
+def paginate_list_users_query(query: Select, limit: int, cursor: str | None) -> Select:
+    if cursor:
+        query = query.where(tuple_(*LIST_SORT_KEY) > decode_cursor(cursor, LIST_SORT_KEY_TYPES))
+    return query.order_by(*LIST_SORT_KEY).limit(limit + 1) # One more row to know if there is a next page
+
+def build_users_page(db_users: list[UserSchema], limit: int, total_estimate: int | None) -> UserPageModel:
+    next_cursor = None
+    if len(db_users) > limit:
+        db_users = db_users[:limit]
+        next_cursor = encode_cursor((db_users[-1].last_name, db_users[-1].first_name, db_users[-1].id))
+    return UserPageModel(items=[UserBaseModel.from_schema(db_user) for db_user in db_users], next_cursor=next_cursor, total_estimate=total_estimate)
+
+def list_users(db: Session, search: str | None, match: str, limit: int, cursor: str | None, include_total: bool) -> UserPageModel:
+    query = build_list_users_query(search, match)
+    db_users = db.scalars(paginate_list_users_query(query, limit, cursor)).all()
+    total_estimate = estimate_count(db, query) if include_total else None
+    return build_users_page(db_users, limit, total_estimate)
+
+# Profile picture storage
+def stat_profile_picture(storage: ObjectStorage, profile_picture_key: str, variant_size: int | None = None, extension: str = "jpeg"):
+    """Stat the variant of the profile picture, or the original while the variants are not generated yet."""
+    if variant_size:
+        try:
+            return storage.backend.stat_object(variant_key(profile_picture_key, variant_size, extension))
+        except S3Error as e:
+            if e.code != "NoSuchKey":
+                raise
+    return storage.backend.stat_object(profile_picture_key)
+
+def profile_picture_response(storage: ObjectStorage, profile_picture_key: str, size: int | None, headers: Headers) -> Response:
+    """
+    Response for the profile picture, or its variant closest to `size` (WebP if accepted by the client, JPEG otherwise).
+    - "redirect" mode: 307 to a presigned URL, cached until shortly before it expires.
+    - "proxy" mode: the bytes are streamed by the API, with ETag (304) and Range (206) support.
+    """
+    variant_size = select_variant_size(settings.user_profile_picture_sizes, size) if size else None
+    extension = "webp" if "image/webp" in headers.get("accept", "") else "jpeg"
+    if settings.user_profile_picture_download_mode == "redirect":
+        cache_key = (profile_picture_key, variant_size, extension if variant_size else None)
+        cached_url = presigned_urls.get(cache_key)
+        if cached_url is None:
+            stat = stat_profile_picture(storage, profile_picture_key, variant_size, extension)
+            url = storage.backend.presigned_get_object(stat.object_name, expires=timedelta(seconds=settings.minio_presigned_url_expiration))
+            # The original served in place of a missing variant is not cached, to pick the variant once generated
+            if not variant_size or stat.object_name != profile_picture_key:
+                presigned_urls.put(cache_key, url, settings.minio_presigned_url_expiration)
+            cached_url = (url, settings.minio_presigned_url_expiration - settings.minio_presigned_url_margin)
+        url, max_age = cached_url
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={int(max_age)}", "Vary": "Accept"})
+
+    stat = stat_profile_picture(storage, profile_picture_key, variant_size, extension)
+    def open_object(offset: int, length: int):
+        return storage.backend.get_object(stat.object_name, offset=offset, length=length)
+    return object_response(open_object, stat, headers, {"Vary": "Accept"})
+
+def remove_profile_picture(db: Session, profile_picture_key: str):
+    """Enqueue the removal of a profile picture and of its variants (committed with the change of the user)."""
+    enqueue(db, "storage.remove_objects", object_names=[profile_picture_key] + variant_keys(profile_picture_key, settings.user_profile_picture_sizes))
+
+def _is_current_profile_picture(profile_picture_key: str) -> bool:
+    with GlobalSessionLocal() as db:
+        return db.scalar(select(UserSchema.id).where(UserSchema.profile_picture_key == profile_picture_key).limit(1)) is not None
+
+@job_handler("user.profile_picture_variants")
+def generate_profile_picture_variants(profile_picture_key: str):
+    """
+    Render the resized variants of a profile picture and store them next to it (job enqueued with the key change).
+    The picture may be replaced or its user deleted meanwhile: nothing is rendered for a key that is no longer
+    current, and the variants written when the key changed during the rendering are deleted again, as the removal
+    job of the key may have run before them.
+    """
+    if not _is_current_profile_picture(profile_picture_key):
+        return
+    response = storage.backend.get_object(profile_picture_key)
+    try:
+        image_data = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+    variants = image_processor.render_variants_blocking(image_data, settings.user_profile_picture_sizes, settings.user_profile_picture_variant_quality)
+    for (size, extension), variant in variants.items():
+        storage.backend.put_object(variant_key(profile_picture_key, size, extension), io.BytesIO(variant), len(variant), VARIANT_FORMATS[extension][1])
+    if not _is_current_profile_picture(profile_picture_key):
+        remove_objects(variant_keys(profile_picture_key, settings.user_profile_picture_sizes))
+
+def get_user_profile_picture(db: Session, storage: ObjectStorage, current_user: UserMailModel, size: int | None, headers: Headers) -> Response:
+    prefer_primary(db, current_user.email)
     db_user = get_and_check_user_by_email(db, current_user.email)
     if not db_user.profile_picture_key:
         raise ImageNotFound()
-    profile_picture = minio_db.get_object(settings.minio_bucket_name, db_user.profile_picture_key)
-    return StreamingResponse(profile_picture, media_type=profile_picture.headers.get("Content-Type"))
+    return profile_picture_response(storage, db_user.profile_picture_key, size, headers)
 
 def update_user_names(db: Session, current_user: UserMailModel, updated_user: UserNamesModel) -> UserBaseModel:
     db_user = get_and_check_user_by_email(db, current_user.email)
@@ -59,57 +189,93 @@ def update_user_names(db: Session, current_user: UserMailModel, updated_user: Us
     if updated_user.last_name: db_user.last_name = updated_user.last_name
     db.commit()
     db.refresh(db_user)
-    return UserBaseModel(**db_user.__dict__)
-
-async def update_user_profile_picture(db: Session, minio_db: Minio, current_user: UserMailModel, profile_picture: UploadFile) -> UserBaseModel:
-    # Check if the file is a valid image
-    if not profile_picture.filename.lower().endswith((".png", ".jpg", ".jpeg")):
-        raise InvalidImage("Only PNG and JPG files are allowed")
-    if not profile_picture.content_type.startswith("image"):
-        raise InvalidImage("Invalid image file")
-    if profile_picture.size > settings.user_profile_picture_max_size:
-        raise InvalidImage("Image file too large")
-    
-    # Update the user's profile picture
-    db_user = get_and_check_user_by_email(db, current_user.email)
-    
-    # Process the image
+    return UserBaseModel.from_schema(db_user)
+
+async def upload_profile_picture(storage: ObjectStorage, email: str, request: Request) -> str:
+    """
+    Stream the profile picture of the request to the object storage and return its key.
+    The size limit is enforced while the bytes arrive and the image format is identified from the content of the file.
+    """
+    chunks = iter_upload(request, "profile_picture", settings.user_profile_picture_max_size)
+    image_format, chunks = await sniff_image(chunks, allowed_formats=("PNG", "JPEG"))
+    profile_picture_key = f"{email}/profile_picture_{secrets.token_hex(8)}.{image_format.lower()}"
+    profile_picture_key = re.sub(r'[^a-zA-Z0-9/_.]', '', profile_picture_key).replace(" ", "_").lower()
     try:
-        profile_picture_key = f"{current_user.email}/{profile_picture.filename.replace('/', '')}"
-        profile_picture_key = re.sub(r'[^a-zA-Z0-9/_.]', '', profile_picture_key).replace(" ", "_").lower()
-        profile_picture_image = await profile_picture.read()    
-        
-        # Delete the previous profile picture
-        if db_user.profile_picture_key:
-            minio_db.remove_object(settings.minio_bucket_name, db_user.profile_picture_key)
-            
-        # Upload the new profile picture
-        minio_db.put_object(settings.minio_bucket_name, profile_picture_key,io.BytesIO(profile_picture_image), len(profile_picture_image), profile_picture.content_type)
-        db_user.profile_picture_key = profile_picture_key
-        db.commit()
-        db.refresh(db_user)
+        await storage.put_stream(profile_picture_key, chunks, f"image/{image_format.lower()}")
     except S3Error:
         raise InvalidImage("Error while uploading the image")
-    return UserBaseModel(**db_user.__dict__)
+    return profile_picture_key
+
+def swap_profile_picture_key(db: Session, email: str, profile_picture_key: str) -> UserSchema:
+    """
+    Set the profile picture key of a user and enqueue the rendering of its variants and the removal of the picture
+    it replaces (committed by the caller).
+    The row is locked and the key is only set if it is still the one read (also on SQLite, which has no row locks),
+    so that the picture of a concurrent upload is never replaced without being removed.
+    """
+    while True:
+        db_user = db.scalars(locked_user_query(email)).first()
+        if not db_user:
+            raise UserNotFound()
+        previous_profile_picture_key = db_user.profile_picture_key
+        swapped = db.execute(update(UserSchema)
+                             .where(UserSchema.id == db_user.id, UserSchema.profile_picture_key.is_not_distinct_from(previous_profile_picture_key))
+                             .values(profile_picture_key=profile_picture_key).execution_options(synchronize_session=False))
+        if swapped.rowcount == 1:
+            break
+        db.rollback() # Replaced meanwhile: read the new key
+    mark_users_changed(db, email)
+    if previous_profile_picture_key:
+        remove_profile_picture(db, previous_profile_picture_key)
+    enqueue(db, "user.profile_picture_variants", profile_picture_key=profile_picture_key)
+    return db_user
+
+def _set_user_profile_picture_key(db: Session, email: str, profile_picture_key: str) -> UserSchema:
+    db_user = swap_profile_picture_key(db, email, profile_picture_key)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+async def update_user_profile_picture(db: Session, storage: ObjectStorage, current_user: UserMailModel, request: Request) -> UserBaseModel:
+    # Check that the user exists before reading the image
+    await run_in_threadpool(get_and_check_user_by_email, db, current_user.email)
+    
+    # Upload the new profile picture
+    profile_picture_key = await upload_profile_picture(storage, current_user.email, request)
+    try:
+        db_user = await run_in_threadpool(_set_user_profile_picture_key, db, current_user.email, profile_picture_key)
+    except BaseException:
+        await storage.remove_object(profile_picture_key)
+        raise
+    return UserBaseModel.from_schema(db_user)
 
 def update_user_email(db: Session, current_user: UserMailModel, updated_user: UserMailModel) -> UserBaseModel:
     db_user = get_and_check_user_by_email(db, current_user.email)
     db_user_with_same_new_email = get_user_by_email(db, updated_user.email)
     if db_user_with_same_new_email:
         raise UserAlreadyExists()
+    revoke_user_tokens(db, db_user.email) # The tokens of the previous email
     db_user.email = updated_user.email
     db.commit()
     db.refresh(db_user)
-    return UserBaseModel(**db_user.__dict__)
+    return UserBaseModel.from_schema(db_user)
 
-def update_user_password(db: Session, current_user: UserMailModel, updated_user: UserUpdatePasswordModel) -> UserBaseModel:
-    db_user = get_and_check_user_by_email(db, current_user.email)
-    if not _verify_password(updated_user.current_password, db_user.hashed_password):
-        raise InvalidPassword()
-    db_user.hashed_password = _get_hashed_password(updated_user.new_password)
+# The routes hashing or checking a password are coroutines: the bcrypt work is awaited (see app.helpers.passwords)
+# instead of blocking a thread of the threadpool, and only the database work runs in the threadpool
+def _set_user_hashed_password(db: Session, db_user: UserSchema, hashed_password: str) -> UserSchema:
+    db_user.hashed_password = hashed_password
+    revoke_user_tokens(db, db_user.email)
     db.commit()
     db.refresh(db_user)
-    return UserBaseModel(**db_user.__dict__)
+    return db_user
+
+async def update_user_password(db: Session, current_user: UserMailModel, updated_user: UserUpdatePasswordModel) -> UserBaseModel:
+    db_user = await run_in_threadpool(get_and_check_user_by_email, db, current_user.email)
+    if not await password_hasher.verify_async(updated_user.current_password, db_user.hashed_password):
+        raise InvalidPassword()
+    hashed_password = await password_hasher.hash_async(updated_user.new_password)
+    db_user = await run_in_threadpool(_set_user_hashed_password, db, db_user, hashed_password)
+    return UserBaseModel.from_schema(db_user)
 
 def update_user_role(db: Session, update_role_user: UserUpdateRoleModel) -> UserBaseModel:   
     db_user = get_and_check_user_by_email(db, update_role_user.email)
@@ -122,19 +288,22 @@ def update_user_role(db: Session, update_role_user: UserUpdateRoleModel) -> User
         raise RoleNotAssignable("At least one user must have the 'admin' role")
     
     db_user.role = update_role_user.role
+    revoke_user_tokens(db, db_user.email) # Their scopes are outdated
     db.commit()
     db.refresh(db_user)
-    return UserBaseModel(**db_user.__dict__)
+    return UserBaseModel.from_schema(db_user)
 
 # User creation
-def create_user(db: Session, user: UserRegisterModel) -> UserBaseModel:
+def _check_new_user(db: Session, user: UserRegisterModel):
     if get_user_by_email(db, user.email):
         raise UserAlreadyExists()
+
+def _insert_user(db: Session, user: UserRegisterModel, hashed_password: str) -> UserSchema:
     db_user = UserSchema(
         first_name=user.first_name,
         last_name=user.last_name,
         email=user.email,
-        hashed_password=_get_hashed_password(user.password),
+        hashed_password=hashed_password,
         role=role_crud.get_default_global_role(db).name
     )
     # If the first user is created, assign the default admin role
@@ -143,28 +312,41 @@ def create_user(db: Session, user: UserRegisterModel) -> UserBaseModel:
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return UserBaseModel(**db_user.__dict__)      
+    return db_user
+
+async def create_user(db: Session, user: UserRegisterModel) -> UserBaseModel:
+    await run_in_threadpool(_check_new_user, db, user)
+    hashed_password = await password_hasher.hash_async(user.password)
+    db_user = await run_in_threadpool(_insert_user, db, user, hashed_password)
+    return UserBaseModel.from_schema(db_user)
 
 # User authentication
-def login_user(db: Session, user: UserLoginModel) -> UserBaseModel:
-    db_user = get_and_check_user_by_email(db, user.email)
-    if not _verify_password(user.password, db_user.hashed_password):
+async def login_user(db: Session, user: UserLoginModel) -> UserBaseModel:
+    db_user = await run_in_threadpool(get_and_check_user_by_email, db, user.email)
+    if not await password_hasher.verify_async(user.password, db_user.hashed_password):
         raise InvalidPassword()
-    return UserBaseModel(**db_user.__dict__)
+    return UserBaseModel.from_schema(db_user)
+
+def logout_user(db: Session, verified_token: VerifiedToken):
+    revoke_token(db, verified_token)
+    db.commit()
 
 # User deletion
-def delete_user(db: Session, minio_db: Minio, current_user: UserMailModel) -> UserBaseModel:
-    db_user = get_and_check_user_by_email(db, current_user.email)
+def delete_user(db: Session, current_user: UserMailModel) -> UserBaseModel:
+    db_user = db.scalars(locked_user_query(current_user.email)).first()
+    if not db_user:
+        raise UserNotFound()
     
     # Chek that the user is not the last admin
     if _is_last_admin(db, db_user):
         raise RoleNotAssignable("At least one user must have the 'admin' role")
     
-    # Delete the user's profile picture
+    # Delete the user's profile picture (by a background job, once the deletion is committed)
     if db_user.profile_picture_key:
-        minio_db.remove_object(settings.minio_bucket_name, db_user.profile_picture_key)
+        remove_profile_picture(db, db_user.profile_picture_key)
         
     # Delete the user
     db.delete(db_user)
+    revoke_user_tokens(db, db_user.email)
     db.commit()
-    return UserBaseModel(**db_user.__dict__)
\ No newline at end of file
+    return UserBaseModel.from_schema(db_user)
\ No newline at end of file
@@ -0,0 +1,167 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Request, Response
+from starlette.datastructures import Headers
+
+from app.exceptions import UserAlreadyExists, UserNotFound, InvalidPassword, RoleNotAssignable, ImageNotFound
+from app.db.storage import ObjectStorage
+from app.helpers.passwords import password_hasher
+from app.helpers.pagination import estimate_count
+from app.modules.user.schemas import UserSchema
+from app.modules.user.cache import user_cache
+from app.helpers.token_cache import VerifiedToken
+from app.modules.user.revocation import revoke_user_tokens, revoke_token
+from app.db.replicas import prefer_primary
+from app.modules.user.models import UserPageModel, UserBaseModel, UserRegisterModel, UserLoginModel, UserNamesModel, UserMailModel, UserUpdatePasswordModel, UserUpdateRoleModel
+from app.modules.user.crud import locked_user_query, swap_profile_picture_key, build_list_users_query, paginate_list_users_query, build_users_page, create_access_token, upload_profile_picture, profile_picture_response, remove_profile_picture
+import app.modules.role.crud_async as role_crud
+
+# Async versions of app.modules.user.crud (see settings.database_async)
+
+# User global roles management
+async def _is_last_admin(db: AsyncSession, user: UserBaseModel) -> bool:
+    admin_role = (await role_crud.get_default_admin_role(db)).name
+    if user.role == admin_role:
+        if await db.scalar(select(func.count()).select_from(UserSchema).where(UserSchema.role == admin_role)) == 1:
+            return True
+    return False
+
+# User getters and setters
+async def get_user_by_email(db: AsyncSession, email: str) -> UserSchema:
+    return await db.scalar(select(UserSchema).where(UserSchema.email == email).limit(1))
+
+async def get_and_check_user_by_email(db: AsyncSession, email: str) -> UserSchema:
+    db_user = await get_user_by_email(db, email)
+    if not db_user:
+        raise UserNotFound()
+    return db_user
+
+async def get_user_me(db: AsyncSession, email: str, if_none_match: str | None) -> Response:
+    async def load_user() -> UserBaseModel:
+        prefer_primary(db, email)
+        return UserBaseModel.from_schema(await get_and_check_user_by_email(db, email))
+    cached_user = await user_cache.aget_or_load(email, load_user)
+    return cached_user.response(if_none_match)
+
+async def list_users(db: AsyncSession, search: str | None, match: str, limit: int, cursor: str | None, include_total: bool) -> UserPageModel:
+    query = build_list_users_query(search, match)
+    db_users = (await db.scalars(paginate_list_users_query(query, limit, cursor))).all()
+    total_estimate = await db.run_sync(estimate_count, query) if include_total else None
+    return build_users_page(db_users, limit, total_estimate)
+
+async def get_user_profile_picture(db: AsyncSession, storage: ObjectStorage, current_user: UserMailModel, size: int | None, headers: Headers) -> Response:
+    prefer_primary(db, current_user.email)
+    db_user = await get_and_check_user_by_email(db, current_user.email)
+    if not db_user.profile_picture_key:
+        raise ImageNotFound()
+    return await storage.run_sync(profile_picture_response, storage, db_user.profile_picture_key, size, headers)
+
+async def update_user_names(db: AsyncSession, current_user: UserMailModel, updated_user: UserNamesModel) -> UserBaseModel:
+    db_user = await get_and_check_user_by_email(db, current_user.email)
+    if updated_user.first_name: db_user.first_name = updated_user.first_name
+    if updated_user.last_name: db_user.last_name = updated_user.last_name
+    await db.commit()
+    await db.refresh(db_user)
+    return UserBaseModel.from_schema(db_user)
+
+async def update_user_profile_picture(db: AsyncSession, storage: ObjectStorage, current_user: UserMailModel, request: Request) -> UserBaseModel:
+    # Check that the user exists before reading the image
+    await get_and_check_user_by_email(db, current_user.email)
+
+    # Upload the new profile picture
+    profile_picture_key = await upload_profile_picture(storage, current_user.email, request)
+    try:
+        db_user = await db.run_sync(swap_profile_picture_key, current_user.email, profile_picture_key)
+        await db.commit()
+        await db.refresh(db_user)
+    except BaseException:
+        await storage.remove_object(profile_picture_key)
+        raise
+    return UserBaseModel.from_schema(db_user)
+
+async def update_user_email(db: AsyncSession, current_user: UserMailModel, updated_user: UserMailModel) -> UserBaseModel:
+    db_user = await get_and_check_user_by_email(db, current_user.email)
+    db_user_with_same_new_email = await get_user_by_email(db, updated_user.email)
+    if db_user_with_same_new_email:
+        raise UserAlreadyExists()
+    revoke_user_tokens(db, db_user.email) # The tokens of the previous email
+    db_user.email = updated_user.email
+    await db.commit()
+    await db.refresh(db_user)
+    return UserBaseModel.from_schema(db_user)
+
+async def update_user_password(db: AsyncSession, current_user: UserMailModel, updated_user: UserUpdatePasswordModel) -> UserBaseModel:
+    db_user = await get_and_check_user_by_email(db, current_user.email)
+    if not await password_hasher.verify_async(updated_user.current_password, db_user.hashed_password):
+        raise InvalidPassword()
+    db_user.hashed_password = await password_hasher.hash_async(updated_user.new_password)
+    revoke_user_tokens(db, db_user.email)
+    await db.commit()
+    await db.refresh(db_user)
+    return UserBaseModel.from_schema(db_user)
+
+async def update_user_role(db: AsyncSession, update_role_user: UserUpdateRoleModel) -> UserBaseModel:
+    db_user = await get_and_check_user_by_email(db, update_role_user.email)
+
+    # Check that the new role is a valid global role
+    await role_crud.get_global_role_by_name(db, update_role_user.role)
+
+    # Do not allow a solitary admin to remove his role
+    if await _is_last_admin(db, db_user) and "admin" not in update_role_user.role:
+        raise RoleNotAssignable("At least one user must have the 'admin' role")
+
+    db_user.role = update_role_user.role
+    revoke_user_tokens(db, db_user.email) # Their scopes are outdated
+    await db.commit()
+    await db.refresh(db_user)
+    return UserBaseModel.from_schema(db_user)
+
+# User creation
+async def create_user(db: AsyncSession, user: UserRegisterModel) -> UserBaseModel:
+    if await get_user_by_email(db, user.email):
+        raise UserAlreadyExists()
+    db_user = UserSchema(
+        first_name=user.first_name,
+        last_name=user.last_name,
+        email=user.email,
+        hashed_password=await password_hasher.hash_async(user.password),
+        role=(await role_crud.get_default_global_role(db)).name
+    )
+    # If the first user is created, assign the default admin role
+    if not await db.scalar(select(func.count()).select_from(UserSchema)):
+        db_user.role = (await role_crud.get_default_admin_role(db)).name
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return UserBaseModel.from_schema(db_user)
+
+# User authentication
+async def login_user(db: AsyncSession, user: UserLoginModel) -> UserBaseModel:
+    db_user = await get_and_check_user_by_email(db, user.email)
+    if not await password_hasher.verify_async(user.password, db_user.hashed_password):
+        raise InvalidPassword()
+    return UserBaseModel.from_schema(db_user)
+
+async def logout_user(db: AsyncSession, verified_token: VerifiedToken):
+    revoke_token(db, verified_token)
+    await db.commit()
+
+# User deletion
+async def delete_user(db: AsyncSession, current_user: UserMailModel) -> UserBaseModel:
+    db_user = await db.scalar(locked_user_query(current_user.email))
+    if not db_user:
+        raise UserNotFound()
+
+    # Chek that the user is not the last admin
+    if await _is_last_admin(db, db_user):
+        raise RoleNotAssignable("At least one user must have the 'admin' role")
+
+    # Delete the user's profile picture (by a background job, once the deletion is committed)
+    if db_user.profile_picture_key:
+        remove_profile_picture(db, db_user.profile_picture_key)
+
+    # Delete the user
+    await db.delete(db_user)
+    revoke_user_tokens(db, db_user.email)
+    await db.commit()
+    return UserBaseModel.from_schema(db_user)
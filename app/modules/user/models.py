@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
 from app.core.config import settings
 
 password_field = Field(
@@ -7,12 +7,25 @@ password_field = Field(
 )
 
 class UserBaseModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
     first_name: str
     last_name: str
     email: EmailStr
     role: str
     profile_picture_key: str | None = None
     
+    @classmethod
+    def from_schema(cls, db_user) -> "UserBaseModel":
+        """Trusted conversion of a UserSchema (its fields were validated when written): no validation done."""
+        return cls.model_construct(
+            first_name=db_user.first_name,
+            last_name=db_user.last_name,
+            email=db_user.email,
+            role=db_user.role,
+            profile_picture_key=db_user.profile_picture_key,
+        )
+    
 class UserRegisterModel(BaseModel):
     first_name: str
     last_name: str
@@ -38,6 +51,24 @@ class UserUpdateRoleModel(BaseModel):
     email: EmailStr
     role: str
 
+class UserPageModel(BaseModel):
+    items: list[UserBaseModel]
+    next_cursor: str | None = None # To be given back to get the next page (None on the last page)
+    total_estimate: int | None = None # Only computed when asked (estimated from the statistics on PostgreSQL)
+
+class UserImportModel(UserRegisterModel):
+    role: str | None = None # Default global role if not given
+
+class UserImportErrorModel(BaseModel):
+    line: int
+    email: str | None = None
+    error: str
+
+class UserImportReportModel(BaseModel):
+    created: int = 0
+    failed: int = 0
+    errors: list[UserImportErrorModel] = [] # Only the first `settings.user_import_max_errors` errors
+
 class TokenBase(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import deque
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db.base import GlobalSessionLocal
+from app.helpers.bloom import BloomFilter
+from app.helpers.token_cache import VerifiedToken
+from app.modules.user.schemas import TokenRevocationSchema
+
+logger = logging.getLogger(__name__)
+
+class TokenRevocations:
+    """
+    Revocation check of the access tokens without database query in the common case (a token not revoked):
+    - the revoked `jti` are kept in a Bloom filter: a token absent from it is not revoked, and the (rare)
+      positives are confirmed in the database;
+    - the "tokens valid after" timestamp of the users (set on a password, role or email change and on deletion)
+      is kept in a dict, and the tokens issued before it are rejected.
+    The revocations committed by this process are applied at once, the ones of the other workers are loaded
+    (incrementally, by id) every `refresh_interval` seconds. The ids are not allocated in commit order: the rows
+    below the greatest id loaded are read again until `commit_margin` seconds have passed (the rows already applied
+    are skipped), so that a transaction committing late is not missed. The filter is rebuilt without the expired
+    revocations every `rebuild_interval` seconds or when it holds more items than its capacity.
+    """
+    def __init__(self, bloom_capacity: int, bloom_error_rate: float, refresh_interval: float, rebuild_interval: float, commit_margin: float):
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.commit_margin = commit_margin
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._valid_after: dict[str, float] = {}
+        self._settled_id = 0 # The rows up to this id are all committed and loaded
+        self._loaded_ids: set[int] = set() # Rows above _settled_id already applied
+        self._high_water: deque[tuple[float, int]] = deque() # (load time, greatest id loaded), oldest first
+        self._rebuilt_at = 0.0
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # Metrics
+        self.checks = 0
+        self.bloom_positives = 0
+        self.revoked = 0
+
+    # Loading
+    def apply(self, email: str, jti: str | None, valid_after: float | None):
+        with self._lock:
+            if jti is not None:
+                self._bloom.add(jti)
+            if valid_after is not None and valid_after > self._valid_after.get(email, 0.0):
+                self._valid_after[email] = valid_after
+
+    def load(self, rebuild: bool = False):
+        now = time.time()
+        with GlobalSessionLocal() as db:
+            if rebuild:
+                db.execute(delete(TokenRevocationSchema).where(TokenRevocationSchema.expires_at < now))
+                db.commit()
+            last_id = 0 if rebuild else self._settled_id
+            rows = db.execute(select(TokenRevocationSchema.id, TokenRevocationSchema.email, TokenRevocationSchema.jti, TokenRevocationSchema.valid_after)
+                              .where(TokenRevocationSchema.id > last_id, TokenRevocationSchema.expires_at >= now)
+                              .order_by(TokenRevocationSchema.id)).all()
+        if rebuild:
+            bloom = BloomFilter(max(self.bloom_capacity, 2 * len(rows)), self.bloom_error_rate)
+            valid_after = {}
+            for _, email, jti, row_valid_after in rows:
+                if jti is not None:
+                    bloom.add(jti)
+                if row_valid_after is not None and row_valid_after > valid_after.get(email, 0.0):
+                    valid_after[email] = row_valid_after
+            with self._lock:
+                self._bloom, self._valid_after = bloom, valid_after
+            self._rebuilt_at = now
+        else:
+            for row_id, email, jti, row_valid_after in rows:
+                if row_id not in self._loaded_ids:
+                    self.apply(email, jti, row_valid_after)
+        self._advance(now, [row[0] for row in rows if row[0] > self._settled_id])
+
+    def _advance(self, now: float, loaded_ids: list[int]):
+        """Record the ids loaded and settle the ones below the greatest id loaded `commit_margin` seconds ago."""
+        self._loaded_ids.update(loaded_ids)
+        greatest_id = max(loaded_ids, default=self._high_water[-1][1] if self._high_water else self._settled_id)
+        self._high_water.append((now, greatest_id))
+        while now - self._high_water[0][0] >= self.commit_margin:
+            self._settled_id = max(self._settled_id, self._high_water.popleft()[1])
+            if not self._high_water:
+                break
+        self._loaded_ids = {row_id for row_id in self._loaded_ids if row_id > self._settled_id}
+
+    def _run(self):
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                self.load(rebuild=self._bloom.full or time.time() - self._rebuilt_at >= self.rebuild_interval)
+            except Exception:
+                logger.exception("Could not load the token revocations")
+
+    def start(self):
+        self.load(rebuild=True)
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="token-revocations", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Checks
+    def _is_jti_revoked(self, jti: str) -> bool:
+        with GlobalSessionLocal() as db:
+            return db.scalar(select(TokenRevocationSchema.id).where(TokenRevocationSchema.jti == jti).limit(1)) is not None
+
+    async def is_revoked(self, verified_token: VerifiedToken) -> bool:
+        self.checks += 1
+        email = verified_token.user.email
+        if verified_token.issued_at is None or verified_token.jti is None: # Issued before the revocation support
+            revoked = True
+        elif verified_token.issued_at < self._valid_after.get(email, 0.0):
+            revoked = True
+        elif verified_token.jti in self._bloom:
+            self.bloom_positives += 1
+            revoked = await run_in_threadpool(self._is_jti_revoked, verified_token.jti)
+        else:
+            revoked = False
+        self.revoked += revoked
+        return revoked
+
+    def stats(self) -> dict:
+        return {
+            "checks": self.checks,
+            "bloom_positives": self.bloom_positives,
+            "revoked": self.revoked,
+            "bloom_items": self._bloom.count,
+            "users": len(self._valid_after),
+        }
+
+token_revocations = TokenRevocations(
+    bloom_capacity=settings.token_revocation_bloom_capacity,
+    bloom_error_rate=settings.token_revocation_bloom_error_rate,
+    refresh_interval=settings.token_revocation_refresh_interval,
+    rebuild_interval=settings.token_revocation_rebuild_interval,
+    commit_margin=settings.token_revocation_commit_margin,
+)
+
+# Revocations (written in the session of the change, applied in memory when it commits)
+def revoke_user_tokens(db: Session, email: str):
+    """Revoke all the tokens of a user issued until now."""
+    now = time.time()
+    db.add(TokenRevocationSchema(email=email, valid_after=now, expires_at=now + settings.jwt_expiration))
+    db.info.setdefault("token_revocations", []).append((email, None, now))
+
+def revoke_token(db: Session, verified_token: VerifiedToken):
+    db.add(TokenRevocationSchema(email=verified_token.user.email, jti=verified_token.jti, expires_at=verified_token.expires_at))
+    db.info.setdefault("token_revocations", []).append((verified_token.user.email, verified_token.jti, None))
+
+@event.listens_for(Session, "after_commit")
+def _apply_revocations(session: Session):
+    for email, jti, valid_after in session.info.pop("token_revocations", ()):
+        token_revocations.apply(email, jti, valid_after)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_revocations(session: Session):
+    session.info.pop("token_revocations", None)
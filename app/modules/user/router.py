@@ -1,73 +1,114 @@
 from typing import Annotated
 from datetime import timedelta
 from pydantic import ValidationError
-from minio import Minio
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, Security, HTTPException, status, UploadFile
+from fastapi import APIRouter, Depends, Security, HTTPException, status, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import StreamingResponse
 
 from app.core.config import settings
+from app.db.storage import ObjectStorage
 import app.modules.user.crud as user_crud
 import app.modules.role.crud as role_crud
-from app.modules.user.models import UserBaseModel, UserRegisterModel, UserLoginModel, UserNamesModel, UserMailModel, UserUpdatePasswordModel, UserUpdateRoleModel, TokenBase
-from app.dependencies import get_global_db, get_minio_db, get_current_user
+from app.helpers.token_cache import VerifiedToken
+from app.modules.user.models import UserPageModel, UserBaseModel, UserRegisterModel, UserLoginModel, UserNamesModel, UserMailModel, UserUpdatePasswordModel, UserUpdateRoleModel, TokenBase
+from app.helpers.responses import ModelResponse
+from app.helpers.throttle import auth_throttle
+from app.dependencies import get_global_db, get_global_read_db, get_storage, get_current_user, get_current_token
 router = APIRouter(
     prefix="/users",
     tags=["users"],
 )
 
+# The profile picture is streamed from the request (see app.helpers.uploads), so its body is documented here
+profile_picture_openapi = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"profile_picture": {"type": "string", "format": "binary"}},
+                    "required": ["profile_picture"],
+                },
+            },
+            "image/png": {"schema": {"type": "string", "format": "binary"}},
+            "image/jpeg": {"schema": {"type": "string", "format": "binary"}},
+        },
+    },
+}
+
 # User information routes
+@router.get("")
+def list_users(current_user: Annotated[UserMailModel, Security(get_current_user, scopes=["global:super_admin"])], db: Annotated[Session, Depends(get_global_read_db)],
+               search: Annotated[str | None, Query(min_length=1, max_length=100, description="Searched name or email")] = None,
+               match: Annotated[str, Query(pattern="^(prefix|contains)$", description="'prefix' (start of a name or of the email) or 'contains'")] = "prefix",
+               limit: Annotated[int, Query(ge=1, le=100)] = 50,
+               cursor: Annotated[str | None, Query(description="'next_cursor' of the previous page")] = None,
+               include_total: Annotated[bool, Query(description="Add an estimate of the number of matching users")] = False) -> UserPageModel:
+    return ModelResponse(user_crud.list_users(db, search, match, limit, cursor, include_total))
+
 @router.get("/me")
-def read_users_me(current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
-    return user_crud.get_and_check_user_by_email(db, current_user.email)
+def read_users_me(request: Request, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_read_db)]) -> UserBaseModel:
+    return user_crud.get_user_me(db, current_user.email, request.headers.get("if-none-match"))
     
 @router.get("/profile_picture")
-def read_user_profile_picture(current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)], minio_db: Annotated[Minio, Depends(get_minio_db)]) -> StreamingResponse:
-    return user_crud.get_user_profile_picture(db, minio_db, current_user)
+def read_user_profile_picture(request: Request, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_read_db)], storage: Annotated[ObjectStorage, Depends(get_storage)], size: Annotated[int | None, Query(ge=1, le=4096, description="Size in pixels of the displayed picture")] = None) -> Response:
+    return user_crud.get_user_profile_picture(db, storage, current_user, size, request.headers)
 
 # User creation and update routes
 @router.post("/register")
-def register(user: UserRegisterModel, db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
-    return user_crud.create_user(db, user)
+async def register(request: Request, user: UserRegisterModel, db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
+    auth_throttle.check_register(request)
+    return ModelResponse(await user_crud.create_user(db, user))
 
 @router.put("/update/names")
 def update_user_names(updated_user: UserNamesModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
-    return user_crud.update_user_names(db, current_user, updated_user)
+    return ModelResponse(user_crud.update_user_names(db, current_user, updated_user))
 
 @router.put("/update/email")
 def update_user_email(updated_user: UserMailModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
-    return user_crud.update_user_email(db, current_user, updated_user)
+    return ModelResponse(user_crud.update_user_email(db, current_user, updated_user))
 
 @router.put("/update/password")
-def update_user_password(updated_user: UserUpdatePasswordModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
-    return user_crud.update_user_password(db, current_user, updated_user)
+async def update_user_password(updated_user: UserUpdatePasswordModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
+    return ModelResponse(await user_crud.update_user_password(db, current_user, updated_user))
 
 @router.put("/update/roles")
 def update_user_role(updated_user: UserUpdateRoleModel, current_user: Annotated[UserMailModel, Security(get_current_user, scopes=["global:super_admin"])],  db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
-    return user_crud.update_user_role(db, updated_user)
+    return ModelResponse(user_crud.update_user_role(db, updated_user))
 
-@router.put("/update/profile_picture")
-async def update_user_profile_picture(profile_picture: UploadFile, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)], minio_db: Annotated[Minio, Depends(get_minio_db)]) -> UserBaseModel:
-    return await user_crud.update_user_profile_picture(db, minio_db, current_user, profile_picture)
+@router.put("/update/profile_picture", openapi_extra=profile_picture_openapi)
+async def update_user_profile_picture(request: Request, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)], storage: Annotated[ObjectStorage, Depends(get_storage)]) -> UserBaseModel:
+    # The resized variants are rendered by a background job (enqueued with the change of the key)
+    user = await user_crud.update_user_profile_picture(db, storage, current_user, request)
+    return ModelResponse(user)
 
 # User login route
 @router.post("/login")
-def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Annotated[Session, Depends(get_global_db)]) -> TokenBase:
+async def login(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Annotated[Session, Depends(get_global_db)]) -> TokenBase:
+    # Throttled by IP and email before the password is checked (bcrypt)
+    auth_throttle.check_login(request, form_data.username)
+    
     # Check that the form_data.username is a valid email and that the user exists
     try:
         form_data_user = UserLoginModel(email=form_data.username, password=form_data.password)
     except ValidationError as e:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors())
-    user = user_crud.login_user(db, form_data_user)
+    user = await user_crud.login_user(db, form_data_user)
     
     # Create the access token
-    access_token_expires = timedelta(minutes=settings.jwt_expiration)
-    access_token_data = {"sub": user.email, "scopes": role_crud.get_user_global_roles_jwt_format(db, user.role)}
+    access_token_expires = timedelta(seconds=settings.jwt_expiration)
+    access_token_data = {"sub": user.email, "scopes": await run_in_threadpool(role_crud.get_user_global_roles_jwt_format, db, user.role)}
     access_token = user_crud.create_access_token(data=access_token_data,expires_delta=access_token_expires)
-    return TokenBase(access_token=access_token, token_type="bearer")
+    return ModelResponse(TokenBase(access_token=access_token, token_type="bearer"))
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(verified_token: Annotated[VerifiedToken, Depends(get_current_token)], db: Annotated[Session, Depends(get_global_db)]) -> None:
+    # Revoke the token of the request (the other tokens of the user stay valid)
+    user_crud.logout_user(db, verified_token)
 
 # User deletion route
 @router.delete("/delete")
-def delete_user(current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)], minio_db: Annotated[Minio, Depends(get_minio_db)]) -> UserBaseModel:
-    return user_crud.delete_user(db, minio_db, current_user)
\ No newline at end of file
+def delete_user(current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[Session, Depends(get_global_db)]) -> UserBaseModel:
+    return ModelResponse(user_crud.delete_user(db, current_user))
\ No newline at end of file
@@ -0,0 +1,98 @@
+from typing import Annotated
+from datetime import timedelta
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Security, HTTPException, status, Request, Response, Query
+from fastapi.security import OAuth2PasswordRequestForm
+
+from app.core.config import settings
+from app.db.storage import ObjectStorage
+import app.modules.user.crud_async as user_crud
+import app.modules.role.crud_async as role_crud
+from app.helpers.token_cache import VerifiedToken
+from app.modules.user.models import UserPageModel, UserBaseModel, UserRegisterModel, UserLoginModel, UserNamesModel, UserMailModel, UserUpdatePasswordModel, UserUpdateRoleModel, TokenBase
+from app.modules.user.router import profile_picture_openapi
+from app.helpers.responses import ModelResponse
+from app.helpers.throttle import auth_throttle
+from app.dependencies import get_global_async_db, get_global_read_async_db, get_storage, get_current_user, get_current_token
+
+# Same routes as app.modules.user.router, served with an AsyncSession (see settings.database_async)
+router = APIRouter(
+    prefix="/users",
+    tags=["users"],
+)
+
+# User information routes
+@router.get("")
+async def list_users(current_user: Annotated[UserMailModel, Security(get_current_user, scopes=["global:super_admin"])], db: Annotated[AsyncSession, Depends(get_global_read_async_db)],
+                     search: Annotated[str | None, Query(min_length=1, max_length=100, description="Searched name or email")] = None,
+                     match: Annotated[str, Query(pattern="^(prefix|contains)$", description="'prefix' (start of a name or of the email) or 'contains'")] = "prefix",
+                     limit: Annotated[int, Query(ge=1, le=100)] = 50,
+                     cursor: Annotated[str | None, Query(description="'next_cursor' of the previous page")] = None,
+                     include_total: Annotated[bool, Query(description="Add an estimate of the number of matching users")] = False) -> UserPageModel:
+    return ModelResponse(await user_crud.list_users(db, search, match, limit, cursor, include_total))
+
+@router.get("/me")
+async def read_users_me(request: Request, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_read_async_db)]) -> UserBaseModel:
+    return await user_crud.get_user_me(db, current_user.email, request.headers.get("if-none-match"))
+    
+@router.get("/profile_picture")
+async def read_user_profile_picture(request: Request, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_read_async_db)], storage: Annotated[ObjectStorage, Depends(get_storage)], size: Annotated[int | None, Query(ge=1, le=4096, description="Size in pixels of the displayed picture")] = None) -> Response:
+    return await user_crud.get_user_profile_picture(db, storage, current_user, size, request.headers)
+
+# User creation and update routes
+@router.post("/register")
+async def register(request: Request, user: UserRegisterModel, db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> UserBaseModel:
+    auth_throttle.check_register(request)
+    return ModelResponse(await user_crud.create_user(db, user))
+
+@router.put("/update/names")
+async def update_user_names(updated_user: UserNamesModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> UserBaseModel:
+    return ModelResponse(await user_crud.update_user_names(db, current_user, updated_user))
+
+@router.put("/update/email")
+async def update_user_email(updated_user: UserMailModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> UserBaseModel:
+    return ModelResponse(await user_crud.update_user_email(db, current_user, updated_user))
+
+@router.put("/update/password")
+async def update_user_password(updated_user: UserUpdatePasswordModel, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> UserBaseModel:
+    return ModelResponse(await user_crud.update_user_password(db, current_user, updated_user))
+
+@router.put("/update/roles")
+async def update_user_role(updated_user: UserUpdateRoleModel, current_user: Annotated[UserMailModel, Security(get_current_user, scopes=["global:super_admin"])],  db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> UserBaseModel:
+    return ModelResponse(await user_crud.update_user_role(db, updated_user))
+
+@router.put("/update/profile_picture", openapi_extra=profile_picture_openapi)
+async def update_user_profile_picture(request: Request, current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_async_db)], storage: Annotated[ObjectStorage, Depends(get_storage)]) -> UserBaseModel:
+    # The resized variants are rendered by a background job (enqueued with the change of the key)
+    user = await user_crud.update_user_profile_picture(db, storage, current_user, request)
+    return ModelResponse(user)
+
+# User login route
+@router.post("/login")
+async def login(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> TokenBase:
+    # Throttled by IP and email before the password is checked (bcrypt)
+    auth_throttle.check_login(request, form_data.username)
+    
+    # Check that the form_data.username is a valid email and that the user exists
+    try:
+        form_data_user = UserLoginModel(email=form_data.username, password=form_data.password)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors())
+    user = await user_crud.login_user(db, form_data_user)
+    
+    # Create the access token
+    access_token_expires = timedelta(seconds=settings.jwt_expiration)
+    access_token_data = {"sub": user.email, "scopes": await role_crud.get_user_global_roles_jwt_format(db, user.role)}
+    access_token = user_crud.create_access_token(data=access_token_data,expires_delta=access_token_expires)
+    return ModelResponse(TokenBase(access_token=access_token, token_type="bearer"))
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(verified_token: Annotated[VerifiedToken, Depends(get_current_token)], db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> None:
+    # Revoke the token of the request (the other tokens of the user stay valid)
+    await user_crud.logout_user(db, verified_token)
+
+# User deletion route
+@router.delete("/delete")
+async def delete_user(current_user: Annotated[UserMailModel, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_global_async_db)]) -> UserBaseModel:
+    return ModelResponse(await user_crud.delete_user(db, current_user))
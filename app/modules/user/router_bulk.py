@@ -0,0 +1,35 @@
+from typing import Annotated
+from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Security, Request, Query
+from fastapi.responses import StreamingResponse
+
+import app.modules.user.bulk as user_bulk
+from app.modules.user.models import UserMailModel, UserImportReportModel
+from app.dependencies import get_global_db, get_current_user
+
+# Bulk routes: the work is batched, so they use the blocking Session in both the sync and the async modes
+router = APIRouter(
+    prefix="/users",
+    tags=["users"],
+)
+
+# The users are streamed from the request (see app.modules.user.bulk), so the body is documented here
+import_openapi = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "text/csv": {"schema": {"type": "string"}, "example": "first_name,last_name,email,password,role\nJane,Doe,jane@example.com,Password1!,user\n"},
+            "application/x-ndjson": {"schema": {"type": "string"}, "example": '{"first_name": "Jane", "last_name": "Doe", "email": "jane@example.com", "password": "Password1!"}\n'},
+        },
+    },
+}
+
+@router.post("/import", openapi_extra=import_openapi)
+async def import_users(request: Request, current_user: Annotated[UserMailModel, Security(get_current_user, scopes=["global:super_admin"])], db: Annotated[Session, Depends(get_global_db)]) -> UserImportReportModel:
+    return await user_bulk.import_users(db, request)
+
+@router.get("/export")
+def export_users(current_user: Annotated[UserMailModel, Security(get_current_user, scopes=["global:super_admin"])], format: Annotated[str, Query(pattern="^(csv|ndjson)$")] = "csv") -> StreamingResponse:
+    if format == "ndjson":
+        return StreamingResponse(user_bulk.export_users_ndjson(), media_type="application/x-ndjson")
+    return StreamingResponse(user_bulk.export_users_csv(), media_type="text/csv", headers={"Content-Disposition": 'attachment; filename="users.csv"'})
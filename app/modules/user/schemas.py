@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, Index, Integer, String, text
+from sqlalchemy.engine import Engine
 
 from app.db.base import GlobalBase
 
@@ -8,6 +9,9 @@ class UserSchema(GlobalBase):
     A user is a person who has an account on the platform.
     """
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_keyset", "last_name", "first_name", "id"), # Sort key of the listing (keyset pagination)
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     first_name = Column(String, index=True, nullable=False)
@@ -24,4 +28,36 @@ class UserSchema(GlobalBase):
         return f"<User {self.first_name} {self.last_name}>"
     
     def __eq__(self, other):
-        return self.email == other.email
\ No newline at end of file
+        return self.email == other.email
+
+class TokenRevocationSchema(GlobalBase):
+    """
+    Revoked access tokens: a single token (`jti`) or all the tokens of a user issued before `valid_after`.
+    A row is useless once the tokens it revokes have expired (`expires_at`), it is then purged.
+    """
+    __tablename__ = "token_revocations"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True) # Loaded incrementally by the workers
+    email = Column(String, nullable=False)
+    jti = Column(String, unique=True, nullable=True)
+    valid_after = Column(Float, nullable=True) # [Unix timestamp]
+    expires_at = Column(Float, index=True, nullable=False) # [Unix timestamp]
+
+# Search indexes (PostgreSQL only): case insensitive prefix search on each column and trigram search on all of them
+SEARCH_DOCUMENT = "lower(first_name || ' ' || last_name || ' ' || email)"
+POSTGRESQL_SEARCH_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_first_name_prefix ON users (lower(first_name) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_last_name_prefix ON users (lower(last_name) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_email_prefix ON users (lower(email) text_pattern_ops)",
+    f"CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)",
+]
+
+def create_user_indexes(engine: Engine):
+    """Create the indexes missing on an existing users table (create_all only creates the indexes of new tables)."""
+    for index in UserSchema.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            for statement in POSTGRESQL_SEARCH_INDEXES:
+                connection.execute(text(statement))
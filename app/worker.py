@@ -0,0 +1,45 @@
+"""
+Standalone worker of the background jobs (see app.db.jobs), to run them outside of the API processes.
+
+Run from the app directory, like the API:
+    python -m app.worker [--threads 4]
+
+The API processes also run the jobs in `job_worker_threads` threads: set EVENTAPP_JOB_WORKER_THREADS=0 for them to
+only enqueue the jobs. Stopped by SIGINT or SIGTERM once the running jobs are done.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from app.core.config import settings
+from app.db.database import init_global_db, close_all_db, init_minio_db, close_minio_db
+from app.db.jobs import job_worker
+from app.helpers.images import image_processor
+import app.modules.user.crud  # noqa: F401 (registers the job handlers of the modules)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=max(1, settings.job_worker_threads))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    stopping = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stopping.set())
+
+    init_global_db()
+    init_minio_db()
+    job_worker.threads = args.threads
+    job_worker.start()
+    logging.getLogger(__name__).info("Job worker started with %s threads", args.threads)
+    try:
+        stopping.wait()
+    finally:
+        job_worker.shutdown()
+        image_processor.shutdown()
+        close_all_db()
+        close_minio_db()
+
+if __name__ == "__main__":
+    main()
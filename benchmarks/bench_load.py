@@ -0,0 +1,184 @@
+"""
+End-to-end load test of the user routes, compared to a stored baseline.
+
+Run from the repository root:
+    python -m benchmarks.bench_load [--concurrency 1 8 32] [--duration 5] [--async-db] [--update-baseline]
+
+The application is booted in-process (httpx ASGI transport) against SQLite and the in-memory object store. Each
+virtual user logs in and uploads a profile picture, then runs a weighted mix of requests for `duration` seconds:
+`/users/me`, `/users/profile_picture`, `/users/login` and `/users/register` (a new user each time). The throughput
+and the p50/p95/p99 latencies are reported for each concurrency level and compared to the baseline of the mode
+(sync or async database) in `benchmarks/baselines/bench_load.json`: the run fails (exit code 1) when the throughput
+drops or a percentile grows by more than `tolerance`. `--update-baseline` stores the results of the run instead.
+
+The baseline depends on the machine: update it on the machine running the comparisons.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ.setdefault("EVENTAPP_STORAGE_BACKEND", "memory")
+import benchmarks.environment  # noqa: F401
+import httpx
+from PIL import Image
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "bench_load.json")
+PASSWORD = "Benchmark1!"
+WORKLOAD = {"me": 50, "profile_picture": 30, "login": 10, "register": 10} # Operation -> weight
+PERCENTILES = (50, 95, 99)
+
+_user_ids = itertools.count()
+
+def _make_picture() -> bytes:
+    image = Image.new("RGB", (256, 256), (200, 120, 40))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.email = None
+        self.headers = {}
+
+    async def register(self) -> httpx.Response:
+        email = f"load{next(_user_ids)}@example.com"
+        response = await self.client.post("/users/register", json={"first_name": "Load", "last_name": "Test", "email": email, "password": PASSWORD})
+        if self.email is None and response.status_code == 200:
+            self.email = email
+        return response
+
+    async def login(self) -> httpx.Response:
+        response = await self.client.post("/users/login", data={"username": self.email, "password": PASSWORD})
+        if response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return response
+
+    async def me(self) -> httpx.Response:
+        return await self.client.get("/users/me", headers=self.headers)
+
+    async def profile_picture(self) -> httpx.Response:
+        return await self.client.get("/users/profile_picture", headers=self.headers)
+
+    async def setup(self, picture: bytes):
+        for step in (self.register(), self.login()):
+            response = await step
+            response.raise_for_status()
+        response = await self.client.put("/users/update/profile_picture", files={"profile_picture": ("picture.png", picture, "image/png")}, headers=self.headers)
+        response.raise_for_status()
+
+async def _run_user(user: VirtualUser, deadline: float, latencies: dict, errors: dict):
+    operations, weights = list(WORKLOAD), list(WORKLOAD.values())
+    while time.perf_counter() < deadline:
+        operation = random.choices(operations, weights)[0]
+        start_time = time.perf_counter()
+        response = await getattr(user, operation)()
+        latencies[operation].append(time.perf_counter() - start_time)
+        if response.status_code >= 400:
+            errors[operation] = errors.get(operation, 0) + 1
+
+def _percentile(values: list[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))] * 1000 if values else 0.0
+
+async def _run_level(users: list[VirtualUser], duration: float) -> dict:
+    latencies = {operation: [] for operation in WORKLOAD}
+    errors = {}
+    start_time = time.perf_counter()
+    await asyncio.gather(*(_run_user(user, start_time + duration, latencies, errors) for user in users))
+    elapsed = time.perf_counter() - start_time
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    result = {"throughput": len(all_latencies) / elapsed, "errors": sum(errors.values())}
+    result.update({f"p{percentile}": _percentile(all_latencies, percentile) for percentile in PERCENTILES})
+    result["operations"] = {operation: {f"p{percentile}": _percentile(values, percentile) for percentile in PERCENTILES} for operation, values in latencies.items()}
+    return result
+
+def _compare(mode: str, results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for concurrency, result in results.items():
+        reference = baseline.get(mode, {}).get(str(concurrency))
+        if reference is None:
+            continue
+        if result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(f"concurrency {concurrency}: throughput {result['throughput']:.1f} req/s < {reference['throughput']:.1f} req/s - {tolerance:.0%}")
+        for percentile in PERCENTILES:
+            key = f"p{percentile}"
+            if result[key] > reference[key] * (1 + tolerance):
+                regressions.append(f"concurrency {concurrency}: {key} {result[key]:.2f} ms > {reference[key]:.2f} ms + {tolerance:.0%}")
+        if result["errors"]:
+            regressions.append(f"concurrency {concurrency}: {result['errors']} failed requests")
+    return regressions
+
+async def _run(args) -> dict:
+    from app.core.config import settings
+    from app.main import app
+    settings.throttle_enabled = False # All the virtual users share one client IP
+    results = {}
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+            picture = _make_picture()
+            users = [VirtualUser(client) for _ in range(max(args.concurrency))]
+            for user in users:
+                await user.setup(picture)
+            await _run_level(users, args.warmup)
+
+            print(f"{'concurrency':>11}{'req/s':>10}{'p50 [ms]':>10}{'p95 [ms]':>10}{'p99 [ms]':>10}{'errors':>8}")
+            for concurrency in args.concurrency:
+                result = await _run_level(users[:concurrency], args.duration)
+                results[concurrency] = result
+                print(f"{concurrency:>11}{result['throughput']:>10.1f}{result['p50']:>10.2f}{result['p95']:>10.2f}{result['p99']:>10.2f}{result['errors']:>8}")
+                for operation, stats in result["operations"].items():
+                    print(f"{operation:>21}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=1, help="Seconds of unrecorded requests before the first level")
+    parser.add_argument("--async-db", action="store_true", help="Run with settings.database_async")
+    parser.add_argument("--rounds", type=int, default=4, help="bcrypt cost factor (low to measure the application, not bcrypt)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression (fraction of the baseline)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    os.environ["EVENTAPP_PASSWORD_HASH_ROUNDS"] = str(args.rounds) # Read when the application is imported
+    os.environ["EVENTAPP_DATABASE_ASYNC"] = str(args.async_db).lower()
+    os.environ.setdefault("EVENTAPP_PASSWORD_HASH_QUEUE_SIZE", str(max(args.concurrency))) # No 503 from the hasher backpressure
+    mode = "async" if args.async_db else "sync"
+    random.seed(0)
+
+    results = asyncio.run(_run(args))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    if args.update_baseline:
+        baseline[mode] = {str(concurrency): {key: round(value, 3) for key, value in result.items() if key in ("throughput", *(f"p{p}" for p in PERCENTILES))} for concurrency, result in results.items()}
+        baseline.setdefault("machine", {}).update({"python": platform.python_version(), "cpus": os.cpu_count(), "rounds": args.rounds, "duration": args.duration})
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Baseline of the {mode} mode written to {args.baseline}")
+        return
+
+    if mode not in baseline:
+        print(f"No baseline for the {mode} mode in {args.baseline} (run with --update-baseline)")
+        return
+    regressions = _compare(mode, results, baseline, args.tolerance)
+    if regressions:
+        print("Regressions against the baseline:", *regressions, sep="\n  ")
+        sys.exit(1)
+    print(f"No regression against the {mode} baseline (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
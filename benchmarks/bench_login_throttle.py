@@ -0,0 +1,117 @@
+"""
+Latency of legitimate logins during a credential-stuffing burst, with and without the login throttle.
+
+Run from the repository root:
+    python -m benchmarks.bench_login_throttle [--users 20] [--victims 100] [--attackers 64] [--attacker-ips 4] [--rounds 12]
+
+The application runs in-process (httpx ASGI transport). `users` legitimate users log in one after the other (every
+`interval` seconds), each from its own IP, in four scenarios: no attack, an attack without the throttle, an attack
+with the throttle, and an attack with the throttle on the accounts of the legitimate users themselves. During an
+attack, `attackers` concurrent clients spread over `attacker-ips` IPs try wrong passwords on the accounts of
+`victims` other users (or of the legitimate users) as fast as they are answered. Without the throttle each attempt
+costs a bcrypt verification and the legitimate logins wait behind them; with it most attempts are answered 429
+before any hashing, and the owners of the attacked accounts can still log in from their own IP.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("EVENTAPP_STORAGE_BACKEND", "memory")
+import benchmarks.environment  # noqa: F401
+import httpx
+
+PASSWORD = "Benchmark1!"
+
+def _client(app, ip: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 50000)), base_url="http://benchmark")
+
+async def _attack(client: httpx.AsyncClient, victims: list[str], stopping: asyncio.Event, counts: dict):
+    while not stopping.is_set():
+        response = await client.post("/users/login", data={"username": random.choice(victims), "password": "WrongPassword1!"})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+async def _register(client: httpx.AsyncClient, email: str, semaphore: asyncio.Semaphore):
+    async with semaphore: # Below the queue size of the password hasher
+        response = await client.post("/users/register", json={"first_name": "Bench", "last_name": "User", "email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+
+async def _legitimate_logins(app, emails: list[str], interval: float) -> tuple[list[float], int]:
+    """Latencies of the successful logins and number of failed ones (e.g. 503 when the password hasher is full)."""
+    latencies = []
+    failures = 0
+    for index, email in enumerate(emails):
+        await asyncio.sleep(interval)
+        async with _client(app, f"192.168.{index // 256}.{index % 256}") as client:
+            start_time = time.perf_counter()
+            response = await client.post("/users/login", data={"username": email, "password": PASSWORD})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start_time)
+            else:
+                failures += 1
+    return latencies, failures
+
+async def _scenario(app, emails: list[str], targets: list[str], args, attackers: int, throttle: bool) -> dict:
+    from app.core.config import settings
+    from app.helpers.throttle import auth_throttle
+    settings.throttle_enabled = throttle
+    auth_throttle.reset()
+    stopping = asyncio.Event()
+    counts = {}
+    clients = [_client(app, f"10.0.{index // 256}.{index % 256}") for index in range(args.attacker_ips)]
+    tasks = [asyncio.create_task(_attack(clients[index % args.attacker_ips], targets, stopping, counts)) for index in range(attackers)]
+    start_time = time.perf_counter()
+    latencies, failures = await _legitimate_logins(app, emails, args.interval)
+    elapsed = time.perf_counter() - start_time
+    stopping.set()
+    await asyncio.gather(*tasks)
+    for client in clients:
+        await client.aclose()
+    latencies = sorted(latencies) or [float("nan")]
+    return {
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "max": latencies[-1] * 1000,
+        "failures": failures,
+        "attempts": sum(counts.values()) / elapsed,
+        "throttled": counts.get(429, 0) / max(1, sum(counts.values())),
+        "busy": counts.get(503, 0) / max(1, sum(counts.values())),
+    }
+
+async def _run(args):
+    from app.core.config import settings
+    from app.main import app
+    async with app.router.lifespan_context(app):
+        settings.throttle_enabled = False
+        emails = [f"user{index}@example.com" for index in range(args.users)]
+        victims = [f"victim{index}@example.com" for index in range(args.victims)]
+        async with _client(app, "172.16.0.1") as client:
+            semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+            await asyncio.gather(*(_register(client, email, semaphore) for email in emails + victims))
+
+        print(f"{args.users} logins, {args.attackers} attackers on {args.attacker_ips} IPs against {args.victims} accounts, bcrypt rounds {args.rounds}")
+        print(f"{'scenario':<24}{'p50 [ms]':>10}{'max [ms]':>10}{'failed':>8}{'attack req/s':>14}{'429':>7}{'503':>7}")
+        scenarios = (
+            ("no attack", victims, 0, True),
+            ("attack, no throttle", victims, args.attackers, False),
+            ("attack, throttle", victims, args.attackers, True),
+            ("attack users, throttle", emails, args.attackers, True), # The attacked accounts log in meanwhile
+        )
+        for name, targets, attackers, throttle in scenarios:
+            result = await _scenario(app, emails, targets, args, attackers, throttle)
+            print(f"{name:<24}{result['p50']:>10.1f}{result['max']:>10.1f}{result['failures']:>8}{result['attempts']:>14.1f}{result['throttled']:>7.0%}{result['busy']:>7.0%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between two legitimate logins")
+    parser.add_argument("--victims", type=int, default=100)
+    parser.add_argument("--attackers", type=int, default=64)
+    parser.add_argument("--attacker-ips", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+    os.environ["EVENTAPP_PASSWORD_HASH_ROUNDS"] = str(args.rounds) # Read when the application is imported
+    asyncio.run(_run(args))
+
+if __name__ == "__main__":
+    main()
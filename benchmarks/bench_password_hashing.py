@@ -0,0 +1,52 @@
+"""
+Login throughput of the password hasher depending on the number of workers.
+
+Run from the repository root:
+    python -m benchmarks.bench_password_hashing [--operations 64] [--rounds 12]
+
+Each run verifies `operations` passwords concurrently (like a burst of `/users/login` calls) and reports
+the number of verifications per second. With the "process" executor the throughput scales with the number
+of workers up to the number of cores. The "inline" executor runs bcrypt in the threadpool of the application,
+where it competes with the request handlers for the threads.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import benchmarks.environment  # noqa: F401
+from app.helpers.passwords import PasswordHasher
+
+async def _run(hasher: PasswordHasher, hashed_password: str, operations: int) -> float:
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*(hasher.verify_async("benchmark-password", hashed_password) for _ in range(operations)))
+    elapsed = time.perf_counter() - start_time
+    assert all(results)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operations", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    configurations = [("inline", 1)] + [("process", workers) for workers in sorted({1, 2, 4, 8, 16, cores}) if workers <= cores]
+    print(f"{'executor':<10}{'workers':>8}{'ops/s':>10}{'latency [ms]':>14}{'speedup':>9}")
+    baseline = None
+    for executor, workers in configurations:
+        hasher = PasswordHasher(executor=executor, workers=workers, queue_size=args.operations, rounds=args.rounds)
+        hasher.start()
+        hashed_password = asyncio.run(hasher.hash_async("benchmark-password"))
+        asyncio.run(_run(hasher, hashed_password, workers))  # Warm up the workers
+        elapsed = asyncio.run(_run(hasher, hashed_password, args.operations))
+        stats = hasher.stats()
+        hasher.shutdown()
+
+        throughput = args.operations / elapsed
+        baseline = baseline or throughput
+        mean_latency = stats["latency_sum"] / stats["completed"] * 1000
+        print(f"{executor:<10}{workers:>8}{throughput:>10.1f}{mean_latency:>14.1f}{throughput / baseline:>8.2f}x")
+
+if __name__ == "__main__":
+    main()
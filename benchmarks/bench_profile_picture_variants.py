@@ -0,0 +1,48 @@
+"""
+Bytes served per profile picture request, before (original) and after (resized variants).
+
+Run from the repository root:
+    python -m benchmarks.bench_profile_picture_variants [--width 3000] [--height 2000]
+
+A photo-like image close to the upload limit is generated, its variants are rendered like after an upload,
+and the size of each response is compared to the original that `/users/profile_picture` used to return.
+"""
+import argparse
+import io
+import random
+import time
+from PIL import Image, ImageFilter
+
+import benchmarks.environment  # noqa: F401
+from app.core.config import settings
+from app.helpers.images import VARIANT_FORMATS, render_variants
+
+def _make_photo(width: int, height: int) -> bytes:
+    # Noise blurred into blobs compresses like a photograph, unlike a flat color
+    random.seed(0)
+    image = Image.frombytes("RGB", (width // 4, height // 4), random.randbytes(3 * (width // 4) * (height // 4)))
+    image = image.filter(ImageFilter.GaussianBlur(2)).resize((width, height), Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    args = parser.parse_args()
+
+    original = _make_photo(args.width, args.height)
+    start_time = time.perf_counter()
+    variants = render_variants(original, settings.user_profile_picture_sizes, settings.user_profile_picture_variant_quality)
+    render_time = time.perf_counter() - start_time
+
+    print(f"original: {args.width}x{args.height} JPEG, {len(original):,} bytes (served for every size before)")
+    print(f"variants rendered in {render_time * 1000:.0f} ms (off the request path)\n")
+    print(f"{'size':>6}{'format':>8}{'bytes':>12}{'vs original':>14}")
+    for (size, extension), variant in sorted(variants.items()):
+        print(f"{size:>6}{extension:>8}{len(variant):>12,}{len(original) / len(variant):>13.0f}x")
+    assert set(extension for _, extension in variants) == set(VARIANT_FORMATS)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""
+Default settings used to import the application in the benchmarks.
+Must be imported before any `app` module since `app.core.config.settings` is created at import time.
+"""
+import os
+import tempfile
+
+BENCHMARK_DIR = os.environ.setdefault("EVENTAPP_BENCHMARK_DIR", tempfile.mkdtemp(prefix="eventapp-bench-"))
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_DEFAULTS = {
+    "EVENTAPP_DATABASE_URL": f"sqlite:///{BENCHMARK_DIR}",
+    "EVENTAPP_DATABASE_NAME": "eventapp.db",
+    "EVENTAPP_MINIO_ENDPOINT": "localhost:9000",
+    "EVENTAPP_MINIO_ACCESS_KEY": "benchmark",
+    "EVENTAPP_MINIO_SECRET_KEY": "benchmark",
+    "EVENTAPP_MINIO_BUCKET_NAME": "eventapp-benchmark",
+    "EVENTAPP_JWT_SECRET_KEY": "benchmark-secret",
+    "EVENTAPP_ROLES_CSV_PATH": os.path.join(ROOT_DIR, "resources", "roles.csv"),
+    "EVENTAPP_LOG_FILE": os.path.join(BENCHMARK_DIR, "app.log"),
+}
+for key, value in _DEFAULTS.items():
+    os.environ.setdefault(key, value)